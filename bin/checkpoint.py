@@ -0,0 +1,83 @@
+"""Checkpoints for resuming Reddit streams where they left off."""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger()
+data_dir = os.environ.get("DATA_DIR", "/tmp/osu-bot")
+
+
+def id_number(fullname):
+    """Convert a fullname like t3_abc123 to a number that increases over time."""
+    return int(fullname.split("_")[-1], 36)
+
+
+class Checkpoint:
+    """
+    The last processed item of a Reddit stream, stored on disk.
+    Reddit IDs increase over time, so anything at or before the checkpoint
+    can be skipped without asking Reddit about it.
+    Unless persist is set, the checkpoint is loaded but never saved.
+    """
+
+    def __init__(self, stream, persist=True):
+        self.path = os.path.join(data_dir, "checkpoint_%s.json" % stream)
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.fullname = None
+        self.created_utc = None
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.fullname = data["fullname"]
+            self.created_utc = data["created_utc"]
+            logger.info("Resuming %s after %s" % (stream, self.fullname))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.info("Loading checkpoint failed: %s" % e)
+
+    def seen(self, thing):
+        """Check whether thing is at or before the checkpoint."""
+        with self.lock:
+            return self.fullname is not None and (
+                id_number(thing.fullname) <= id_number(self.fullname)
+            )
+
+    def advance(self, thing):
+        """Move the checkpoint up to thing, if it's newer."""
+        with self.lock:
+            if self.fullname is not None and (
+                id_number(thing.fullname) <= id_number(self.fullname)
+            ):
+                return
+            self.fullname = thing.fullname
+            self.created_utc = thing.created_utc
+            if not self.persist:
+                return
+            data = {"fullname": self.fullname, "created_utc": self.created_utc}
+            try:
+                os.makedirs(data_dir, exist_ok=True)
+                tmp = "%s.tmp" % self.path
+                with open(tmp, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logger.info("Saving checkpoint failed: %s" % e)
+
+    def catch_up(self, listing):
+        """
+        Collect the unseen items of a newest-first listing, oldest first.
+        Without a checkpoint, there's nothing to catch up on.
+        """
+        if self.fullname is None:
+            return []
+        items = []
+        for thing in listing:
+            if self.seen(thing):
+                break
+            items.append(thing)
+        logger.info("Catching up on %d items" % len(items))
+        return list(reversed(items))
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import itertools
 import json
 import logging
 import os
@@ -7,6 +8,10 @@ import praw
 import re
 import requests
 import sys
+import threading
+import time
+from checkpoint import Checkpoint, id_number
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,9 +24,21 @@ score_re = re.compile(".+[\|丨].+-.+\[.+\]")
 user = os.environ.get("OSU_BOT_USER", "osu-bot")
 sub = os.environ.get("OSU_BOT_SUB", "osugame")
 api = f'{os.environ.get("API_HOST")}:{os.environ.get("FLASK_RUN_PORT", 5000)}/scorepost'
+workers = int(os.environ.get("MONITOR_WORKERS", 4))
+max_pending = int(os.environ.get("MONITOR_MAX_PENDING", 16))
+max_attempts = 5
+retry_statuses = [429, 502, 503, 504]
 logger = logging.getLogger()
 logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO)
 
+pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatch")
+slots = threading.BoundedSemaphore(max_pending)
+in_flight = {}  # Post ID -> post, for posts currently being dispatched.
+failed = {}  # Post ID -> post, for posts that couldn't be dispatched.
+in_flight_lock = threading.Lock()
+# Test runs don't comment, so they mustn't move production's checkpoint.
+checkpoint = Checkpoint("submissions", persist=not test)
+
 def monitor():
     reddit = praw.Reddit(
         client_id=os.environ["REDDIT_CLIENT_ID"],
@@ -32,20 +49,102 @@ def monitor():
     )
     subreddit = reddit.subreddit(sub)
 
-    for post in subreddit.stream.submissions():
+    # Catch up on anything posted since the last run before streaming.
+    posts = itertools.chain(
+        checkpoint.catch_up(subreddit.new(limit=None)),
+        subreddit.stream.submissions(),
+    )
+    for post in posts:
+        if checkpoint.seen(post):
+            continue
         if not nofilter and not score_re.match(post.title):
             logger.info("Skipping '%s' - '%s'" % (post.id, post.title))
+            finished(post)
             continue
         if not test and post.saved:
             logger.info("Skipping '%s' - '%s'" % (post.id, post.title))
+            finished(post)
+            continue
+
+        if auto:
+            dispatch(post)
             continue
 
         post_api(post.id)
+        finished(post)
 
         print("\n====================================\n")
-        if not auto:
-            input("Press enter to proceed to the next post: ")
-            print()
+        input("Press enter to proceed to the next post: ")
+        print()
+
+
+def dispatch(post):
+    """
+    Post to the API in the background.
+    Blocks while max_pending posts are already in progress, and skips posts
+    that are already in progress so that each post is handled in order.
+    """
+    with in_flight_lock:
+        if post.id in in_flight:
+            logger.info("Post '%s' is already being dispatched" % post.id)
+            return
+        in_flight[post.id] = post
+        failed.pop(post.id, None)
+        depth = len(in_flight)
+    logger.info("Dispatching '%s' (queue depth %d)" % (post.id, depth))
+    slots.acquire()
+    pool.submit(dispatch_worker, post, time.time())
+
+
+def dispatch_worker(post, queued_at):
+    """
+    Post to the API, backing off while the server is saturated.
+    Posts that are given up on hold the checkpoint back, so that they're
+    tried again after a restart.
+    """
+    started = time.time()
+    done = False
+    try:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                status = post_api(post.id)
+            except Exception as e:
+                logger.info("Request exception: %s" % e)
+                status = None
+            if status is not None and status not in retry_statuses:
+                done = True
+                break
+            if attempt == max_attempts:
+                logger.info("Giving up on '%s'" % post.id)
+                break
+            delay = 2 ** attempt
+            logger.info("Retrying '%s' in %d seconds" % (post.id, delay))
+            time.sleep(delay)
+    finally:
+        with in_flight_lock:
+            in_flight.pop(post.id, None)
+            if not done:
+                failed[post.id] = post
+            depth = len(in_flight)
+        slots.release()
+    if done:
+        finished(post)
+    logger.info(
+        "Dispatched '%s' in %.2fs after waiting %.2fs (queue depth %d)"
+        % (post.id, time.time() - started, started - queued_at, depth)
+    )
+
+
+def finished(post):
+    """
+    Move the checkpoint up to post, unless older posts are still in progress
+    or failed.
+    """
+    with in_flight_lock:
+        held = itertools.chain(in_flight.values(), failed.values())
+        older = [p for p in held if id_number(p.fullname) < id_number(post.fullname)]  # noqa
+    if not older:
+        checkpoint.advance(post)
 
 
 def post_api(p_id):
@@ -57,7 +156,7 @@ def post_api(p_id):
     # data = resp.json()
     # print(data)
     logger.info(f"Post success, got status {resp.status_code}")
-    return resp.status_code == 200
+    return resp.status_code
 
 
 if __name__ == "__main__":
@@ -68,6 +167,7 @@ if __name__ == "__main__":
     logger.info("auto = %s" % auto)
     logger.info("nofilter = %s" % nofilter)
     logger.info("test = %s" % test)
+    logger.info("workers = %d" % workers)
 
     while True:
         try:
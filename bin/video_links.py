@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import heapq
+import json
 import logging
 import os
 import praw
@@ -7,6 +9,8 @@ import re
 import requests
 import sys
 import time
+from checkpoint import Checkpoint
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,11 +23,22 @@ yt_re = re.compile("https?://(?:www\.)?(?:youtu\.be/|youtube\.com/watch\?v=)([\w
 yt_key = os.environ.get("YOUTUBE_KEY")
 video_header = "YouTube links:"
 time_threshold = 30  # Seconds.
+max_attempts = 3
+data_dir = os.environ.get("DATA_DIR", "/tmp/osu-bot")
+pending_path = os.path.join(data_dir, "pending_videos.json")
 yt_api = "https://www.googleapis.com/youtube/v3/videos"
+yt_batch_size = 50  # The most IDs the API accepts per request.
+yt_cache_size = 1000
+yt_cache_ttl = 24 * 60 * 60  # Seconds.
 logger = logging.getLogger()
 logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO)
 
 reddit = None
+pending = []  # Heap of (due timestamp, comment ID, attempts).
+yt_session = requests.Session()
+yt_cache = OrderedDict()  # Video ID -> (expiry timestamp, (title, channel)).
+# Test runs don't edit anything, so they mustn't move production's checkpoint.
+checkpoint = Checkpoint("comments", persist=not test)
 
 
 def reddit_login():
@@ -38,7 +53,7 @@ def reddit_login():
     )
 
 
-def process_comment(comment):
+def process_comment(comment, delayed=False):
     if not comment.is_root or comment.saved:
         return
 
@@ -46,6 +61,15 @@ def process_comment(comment):
     if not match:
         return
 
+    # Sometimes video comments get made before the bot comment is posted.
+    # This could be made a bit less conservative by comparing the current time
+    # rather than the post creation time, but the Reddit timestamps seem off
+    # relative to normal UTC (but at least they're consistent with each other).
+    if not delayed and comment.created_utc - comment.submission.created_utc < time_threshold:  # noqa
+        logger.info("Parking comment %s" % comment.id)
+        schedule(comment.id, time_threshold)
+        return
+
     bot_comment = find_bot_comment(comment)
     if bot_comment is None:
         return
@@ -55,32 +79,98 @@ def process_comment(comment):
 
 
 def process_backlog():
-    """Process the 100 most recent comments."""
-    for comment in reddit.subreddit(sub).comments():
+    """
+    Process the comments made since the last run,
+    or the 100 most recent comments if there was no last run.
+    """
+    subreddit = reddit.subreddit(sub)
+    if checkpoint.fullname:
+        comments = checkpoint.catch_up(subreddit.comments(limit=None))
+    else:
+        comments = list(reversed(list(subreddit.comments())))
+    prefetch_youtube_data(comments)
+    for comment in comments:
         process_comment(comment)
+        checkpoint.advance(comment)
 
 
 def process_stream():
-    """Process comments as they arrive."""
-    for comment in reddit.subreddit(sub).stream.comments():
-        process_comment(comment)
+    """Process comments as they arrive, along with parked comments."""
+    # With pause_after=0, the stream yields None whenever it runs out of new
+    # comments, which gives parked comments a chance to be processed.
+    for comment in reddit.subreddit(sub).stream.comments(pause_after=0):
+        process_pending()
+        if comment is not None and not checkpoint.seen(comment):
+            process_comment(comment)
+            checkpoint.advance(comment)
+
+
+def schedule(c_id, delay, attempts=0):
+    """Park a comment to be processed again after delay seconds."""
+    heapq.heappush(pending, (time.time() + delay, c_id, attempts))
+    save_pending()
+
+
+def process_pending():
+    """Process parked comments that are due."""
+    due = []
+    while pending and pending[0][0] <= time.time():
+        due.append(heapq.heappop(pending))
+    if not due:
+        return
+    save_pending()
+
+    # Fetch all the comments at once. Fresh comment objects also mean
+    # fresh comments on their posts.
+    try:
+        fullnames = ["t1_%s" % c_id for _, c_id, _ in due]
+        comments = {c.id: c for c in reddit.info(fullnames=fullnames)}
+    except Exception as e:
+        logger.info("Fetching parked comments failed: %s" % e)
+        comments = {}
+    prefetch_youtube_data(comments.values())
+
+    for _, c_id, attempts in due:
+        logger.info("Processing parked comment %s" % c_id)
+        try:
+            comment = comments.get(c_id) or reddit.comment(c_id)
+            process_comment(comment, delayed=True)
+        except Exception as e:
+            logger.info("Parked comment exception: %s" % e)
+            if attempts + 1 < max_attempts:
+                schedule(c_id, time_threshold, attempts=attempts + 1)
+
+
+def save_pending():
+    """Write parked comments to disk so that they survive restarts."""
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        tmp = "%s.tmp" % pending_path
+        with open(tmp, "w") as f:
+            json.dump(pending, f)
+        os.replace(tmp, pending_path)
+    except Exception as e:
+        logger.info("Saving parked comments failed: %s" % e)
+
+
+def load_pending():
+    """Read parked comments from disk."""
+    global pending
+    try:
+        with open(pending_path) as f:
+            pending = [tuple(p) for p in json.load(f)]
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.info("Loading parked comments failed: %s" % e)
+        return
+    heapq.heapify(pending)
+    logger.info("Loaded %d parked comments" % len(pending))
 
 
 def find_bot_comment(other):
     """Look for a comment by the bot on the post that other replied to."""
     submission = other.submission
-
-    # Sometimes video comments get made before the bot comment is posted.
-    # This could be made a bit less conservative by comparing the current time
-    # rather than the post creation time, but the Reddit timestamps seem off
-    # relative to normal UTC (but at least they're consistent with each other).
-    if other.created_utc - submission.created_utc < time_threshold:
-        logger.info("Sleeping")
-        time.sleep(time_threshold)
-        # To refresh the comments, we're stuck using this private method
-        # or creating a new instance.
-        submission._fetch()
-
     logger.info("Searching post %s" % submission.id)
 
     for comment in submission.comments:
@@ -93,24 +183,65 @@ def find_bot_comment(other):
 
 def get_youtube_data(yt_id):
     """Get the title and creator of a YouTube video."""
-    params = {"id": yt_id, "part": "snippet", "key": yt_key}
-    try:
-        resp = requests.get(yt_api, params=params)
-    except Exception as e:
-        logger.info("Request exception: %s" % e)
-        return None, None
+    return get_youtube_data_batch([yt_id]).get(yt_id, (None, None))
+
+
+def get_youtube_data_batch(yt_ids):
+    """
+    Get the titles and creators of YouTube videos, keyed by video ID.
+    Cached videos are reused, and the rest are looked up in batches.
+    """
+    results = {}
+    missing = []
+    for yt_id in dict.fromkeys(yt_ids):
+        cached = yt_cache.get(yt_id)
+        if cached and cached[0] > time.time():
+            yt_cache.move_to_end(yt_id)
+            results[yt_id] = cached[1]
+        else:
+            missing.append(yt_id)
+
+    for i in range(0, len(missing), yt_batch_size):
+        batch = missing[i : i + yt_batch_size]
+        params = {"id": ",".join(batch), "part": "snippet", "key": yt_key}
+        try:
+            resp = yt_session.get(yt_api, params=params, timeout=10)
+        except Exception as e:
+            logger.info("Request exception: %s" % e)
+            continue
 
-    if resp.status_code != 200:
-        logger.info("YouTube API returned %d" % resp.status_code)
-        return None, None
+        if resp.status_code != 200:
+            logger.info("YouTube API returned %d" % resp.status_code)
+            continue
+
+        try:
+            items = resp.json()["items"]
+        except Exception as e:
+            logger.info("JSON error: %s" % e)
+            continue
+
+        for item in items:
+            data = item.get("snippet", {})
+            results[item["id"]] = data.get("title"), data.get("channelTitle")
+            yt_cache[item["id"]] = time.time() + yt_cache_ttl, results[item["id"]]
+            yt_cache.move_to_end(item["id"])
+        while len(yt_cache) > yt_cache_size:
+            yt_cache.popitem(last=False)
+
+    return results
 
-    try:
-        data = resp.json()["items"][0]["snippet"]
-    except Exception as e:
-        logger.info("JSON error: %s" % e)
-        return None, None
 
-    return data.get("title"), data.get("channelTitle")
+def prefetch_youtube_data(comments):
+    """Look up the videos linked in unprocessed comments, in batches."""
+    yt_ids = []
+    for comment in comments:
+        if not comment.is_root or comment.saved:
+            continue
+        match = yt_re.search(comment.body)
+        if match:
+            yt_ids.append(match.group(1))
+    if yt_ids:
+        get_youtube_data_batch(yt_ids)
 
 
 def edit_bot_comment(comment, yt_id):
@@ -135,9 +266,9 @@ def edit_bot_comment(comment, yt_id):
     url = "https://youtu.be/%s" % yt_id
 
     title, channel = get_youtube_data(yt_id)
-    title = title.replace(")", "\)")
-    channel = channel.replace(")", "\)")
     if bool(title) and bool(channel):
+        title = title.replace(")", "\)")
+        channel = channel.replace(")", "\)")
         url += " \"'%s' by '%s'\"" % (title, channel)
 
     lines[idx] += " [[%d]](%s)" % (n, url)
@@ -162,6 +293,7 @@ if __name__ == "__main__":
 
     reddit_login()
     logger.info("test = %s" % test)
+    load_pending()
 
     try:
         process_backlog()
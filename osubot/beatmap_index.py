@@ -0,0 +1,93 @@
+import threading
+
+from collections import OrderedDict, defaultdict
+
+from . import consts
+from .utils import bounded_levenshtein, map_str, normalize
+
+
+class BeatmapIndex:
+    """
+    An in-memory index of resolved beatmaps for fuzzy title lookups.
+    Beatmaps are indexed by the trigrams of their normalized map_str, so
+    only beatmaps sharing enough trigrams with a query are compared to it.
+    Only beatmap IDs are kept, since everything else about a beatmap, like its
+    ranked status, can change.
+    Once there are more than max_size beatmaps, the least recently used
+    ones are forgotten.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.beatmaps = OrderedDict()  # Beatmap ID -> normalized string.
+        self.trigrams = defaultdict(set)  # Trigram -> beatmap IDs.
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.beatmaps)
+
+    def add(self, beatmap):
+        """Add a beatmap to the index, replacing any older version of it."""
+        s = normalize(map_str(beatmap))
+        with self.lock:
+            self.remove(beatmap.beatmap_id)
+            self.beatmaps[beatmap.beatmap_id] = s
+            for t in trigrams(s):
+                self.trigrams[t].add(beatmap.beatmap_id)
+            while len(self.beatmaps) > self.max_size:
+                self.remove(next(iter(self.beatmaps)))
+
+    def remove(self, b_id):
+        """Remove a beatmap from the index. The lock must be held."""
+        if b_id not in self.beatmaps:
+            return
+        s = self.beatmaps.pop(b_id)
+        for t in trigrams(s):
+            self.trigrams[t].discard(b_id)
+            if not self.trigrams[t]:
+                del self.trigrams[t]
+
+    def lookup(self, s, max_distance=2):
+        """
+        Find beatmaps within max_distance edits of s.
+        Returns a list of (distance, beatmap ID), closest first.
+        """
+        s = normalize(s)
+        query = trigrams(s)
+        # Each edit changes at most 3 trigrams, so any match must share
+        # at least this many with the query.
+        min_shared = len(query) - 3 * max_distance
+
+        with self.lock:
+            if min_shared > 0:
+                shared = defaultdict(int)
+                for t in query:
+                    for b_id in self.trigrams.get(t, ()):
+                        shared[b_id] += 1
+                b_ids = [b_id for b_id, n in shared.items() if n >= min_shared]
+            else:  # The query is too short to filter anything out.
+                b_ids = list(self.beatmaps)
+            candidates = [(b_id, self.beatmaps[b_id]) for b_id in b_ids]
+
+        results = []
+        for b_id, other in candidates:
+            distance = bounded_levenshtein(s, other, max_distance)
+            if distance <= max_distance:
+                results.append((distance, b_id))
+        results.sort(key=lambda r: r[0])
+
+        if results:
+            with self.lock:
+                for _, b_id in results:
+                    if b_id in self.beatmaps:
+                        self.beatmaps.move_to_end(b_id)
+
+        return results
+
+
+def trigrams(s):
+    """Get the set of trigrams in s."""
+    return {s[i : i + 3] for i in range(len(s) - 2)}
+
+
+index = BeatmapIndex(consts.beatmap_index_entries)
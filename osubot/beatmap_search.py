@@ -1,10 +1,35 @@
 import datetime
 
 from . import consts
+from .beatmap_index import index
+from .cache import LRUCache
+from .records import Beatmap
 from .utils import compare, map_str, request, safe_call
 
+# Beatmap metadata keyed by beatmap ID.
+beatmap_cache = LRUCache(consts.beatmap_meta_entries, ttl=consts.beatmap_meta_ttl)
+
 
 def search(player, beatmap, logs=[]):
+    """
+    Search for beatmap, first among beatmaps found before, then with player.
+    Beatmaps found before are only trusted when exactly one matches exactly,
+    since different maps can share a name and near matches can be typos.
+    """
+    exact = [b_id for d, b_id in index.lookup(beatmap) if d == 0]
+    if len(exact) == 1:
+        result = get_beatmap(exact[0])
+        if result:
+            logs.append("Beatmap: Found in index")
+            return result
+
+    result = search_player(player, beatmap, logs=logs)
+    if result:
+        index.add(result)
+    return result
+
+
+def search_player(player, beatmap, logs=[]):
     """Search for beatmap with player."""
     if player:
         result = search_events(player, beatmap)
@@ -39,10 +64,9 @@ def search_events(player, beatmap, mode=False, b_id=None):
         ):
             if mode:
                 return consts.eventstr2mode.get(match.group(2), None)
-            b_id = event.beatmap_id
-            beatmaps = safe_call(consts.osu_api.get_beatmaps, beatmap_id=b_id)
-            if beatmaps:
-                return beatmaps[0]
+            bmap = get_beatmap(event.beatmap_id)
+            if bmap:
+                return bmap
 
     return None
 
@@ -55,16 +79,8 @@ def search_best(player, beatmap):
 
     today = datetime.datetime.today()
     threshold = datetime.timedelta(weeks=1)
-    for score in filter(lambda s: today - s.date < threshold, best):
-        beatmaps = safe_call(consts.osu_api.get_beatmaps, beatmap_id=score.beatmap_id,)
-        if not beatmaps:
-            continue
-        bmap = beatmaps[0]
-
-        if compare(map_str(bmap), beatmap):
-            return bmap
-
-    return None
+    recent_best = filter(lambda s: today - s.date < threshold, best)
+    return search_ids([s.beatmap_id for s in recent_best], beatmap)
 
 
 def search_recent(player, beatmap):
@@ -73,17 +89,48 @@ def search_recent(player, beatmap):
     if not recent:
         return None
 
-    ids = []
-    for score in recent:
-        if score.beatmap_id in ids:
-            continue
-        ids.append(score.beatmap_id)
+    return search_ids([s.beatmap_id for s in recent], beatmap)
 
-        beatmaps = safe_call(consts.osu_api.get_beatmaps, beatmap_id=score.beatmap_id,)
-        if not beatmaps:
-            continue
-        bmap = beatmaps[0]
 
-        if compare(map_str(bmap), beatmap):
+def search_ids(b_ids, beatmap):
+    """
+    Find the first of some beatmap IDs whose beatmap matches beatmap.
+    Cached beatmaps are checked first, then the rest are looked up concurrently.
+    Lookups still pending when a match is found are cancelled.
+    """
+    b_ids = list(dict.fromkeys(b_ids))  # Remove duplicates, keep order.
+
+    for b_id in b_ids:
+        bmap = beatmap_cache.get(b_id)
+        if bmap and compare(map_str(bmap), beatmap):
             return bmap
+
+    futures = [
+        consts.lookup_pool.submit(get_beatmap, b_id)
+        for b_id in b_ids
+        if b_id not in beatmap_cache
+    ]
+    try:
+        for future in futures:
+            bmap = future.result()
+            if bmap and compare(map_str(bmap), beatmap):
+                return bmap
+    finally:
+        for future in futures:
+            future.cancel()
+
     return None
+
+
+def get_beatmap(b_id):
+    """Get a beatmap by ID, using the cache when possible."""
+    bmap = beatmap_cache.get(b_id)
+    if bmap is not None:
+        return bmap
+
+    beatmaps = safe_call(consts.osu_api.get_beatmaps, beatmap_id=b_id)
+    if not beatmaps:
+        return None
+    bmap = Beatmap.from_api(beatmaps[0])
+    beatmap_cache.put(b_id, bmap)
+    return bmap
@@ -0,0 +1,205 @@
+import functools
+import re
+import requests_cache
+import threading
+import time
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache.
+    Every entry has a size (1 by default), and the least recently used entries
+    are evicted whenever the total size exceeds max_size.
+    If ttl is set, entries also expire that many seconds after being stored.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.entries = OrderedDict()  # Key -> (value, size, expiry).
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        """Get the value for key, or default if it's not cached."""
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, size, expiry = self.entries[key]
+            if expiry is not None and expiry < time.time():
+                del self.entries[key]
+                self.size -= size
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size=1):
+        """Store value under key, evicting old entries if necessary."""
+        if size > self.max_size:
+            return
+        expiry = None if self.ttl is None else time.time() + self.ttl
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = value, size, expiry
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, old_size, _) = self.entries.popitem(last=False)
+                self.size -= old_size
+
+    def pop(self, key, default=None):
+        """Remove and return the value for key, or default."""
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, size, _ = self.entries.pop(key)
+            self.size -= size
+            return value
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one.
+    The first caller runs the function, and anyone who asks for the same key
+    while it's running waits for it and shares its result or exception.
+    """
+
+    def __init__(self):
+        self.calls = {}  # Key -> Future.
+        self.lock = threading.Lock()
+
+    def do(self, key, f, *args, **kwargs):
+        """Call f(*args, **kwargs), unless a call for key is already running."""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = f(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class SingleFlightProxy:
+    """
+    Wraps an object so that concurrent identical calls to its methods whose
+    names start with prefix share one call.
+    """
+
+    def __init__(self, obj, prefix="get_"):
+        self.obj = obj
+        self.prefix = prefix
+        self.flights = SingleFlight()
+
+    def __getattr__(self, name):
+        attr = getattr(self.obj, name)
+        if not name.startswith(self.prefix) or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return attr(*args, **kwargs)
+            return self.flights.do(key, attr, *args, **kwargs)
+
+        return call
+
+
+class CountingSession(requests_cache.CachedSession):
+    """
+    A CachedSession that counts cache hits and misses per endpoint.
+    If max_size is set, every prune_interval requests, expired responses are
+    deleted, and then the ones closest to expiring until the stored responses
+    take up no more than max_size bytes.
+    """
+
+    def __init__(self, *args, max_size=None, prune_interval=100, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self.sent = 0
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.stats_lock = threading.Lock()
+        self.prune_lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        resp = super().send(request, **kwargs)
+        outcome = "hits" if getattr(resp, "from_cache", False) else "misses"
+        with self.stats_lock:
+            self.stats[endpoint(request.url)][outcome] += 1
+            self.sent += 1
+            prune = self.max_size is not None and self.sent % self.prune_interval == 0
+        if prune:
+            try:
+                self.prune()
+            except Exception as e:
+                print("Pruning HTTP cache failed: %s" % e)
+        return resp
+
+    def prune(self):
+        """
+        Shrink the cache to max_size bytes, starting with expired responses.
+        The database is vacuumed once at the end, since that rewrites it all.
+        """
+        if not self.prune_lock.acquire(blocking=False):
+            return  # Another thread is already on it.
+        try:
+            responses = self.cache.responses
+            self.cache.delete(expired=True, vacuum=False)
+            with responses.connection() as conn:
+                rows = conn.execute(
+                    "SELECT key, LENGTH(value) FROM %s ORDER BY expires"
+                    % responses.table_name
+                ).fetchall()
+            size = sum(n for _, n in rows)
+            keys = []
+            for key, n in rows:
+                if size <= self.max_size:
+                    break
+                keys.append(key)
+                size -= n
+            if keys:
+                self.cache.delete(*keys, vacuum=False)
+            responses.vacuum()
+        finally:
+            self.prune_lock.release()
+
+    def cache_stats(self):
+        """Get a copy of the hit/miss counters."""
+        with self.stats_lock:
+            return {k: dict(v) for k, v in self.stats.items()}
+
+
+def endpoint(url):
+    """Strip the query and any IDs or hashes from a URL."""
+    u = urlparse(url)
+    return re.sub("/(?:\\d+|[0-9a-f]{32})(?=/|$)", "/*", u.netloc + u.path)
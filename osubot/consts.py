@@ -1,14 +1,54 @@
 import boto3
+import datetime
+import importlib.metadata
 import os
 import osuapi
 import re
 import requests_cache
 import rosu_pp_py as rosu
 
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import CountingSession, SingleFlightProxy
+
 # Web stuff
-sess = requests_cache.CachedSession(backend="memory", expire_after=300,)  # 5 minutes.
+data_dir = os.environ.get("DATA_DIR", "/tmp/osu-bot")
+os.makedirs(data_dir, exist_ok=True)
+# Earlier patterns take precedence. Strings match URL prefixes, and regexes
+# match anywhere in the URL, query included.
+http_ttls = {
+    # A mapper's listing changes whenever they upload or get ranked.
+    re.compile(r"osu\.ppy\.sh/api/get_beatmaps\?(.*&)?u="): datetime.timedelta(
+        minutes=30
+    ),
+    # Unranked maps can be updated, and the status isn't known from the URL.
+    "osu.ppy.sh/api/get_beatmaps": datetime.timedelta(hours=1),
+    "osu.ppy.sh/api/get_user_recent": datetime.timedelta(seconds=30),
+    "osu.ppy.sh/api/get_user_best": datetime.timedelta(minutes=10),
+    "osu.ppy.sh/api/get_user": datetime.timedelta(minutes=5),
+    "osu.ppy.sh/api/get_scores": datetime.timedelta(minutes=10),
+    # .osu files go in the beatmap store instead.
+    "old.ppy.sh/osu/": requests_cache.DO_NOT_CACHE,
+    "old.ppy.sh/b/": datetime.timedelta(minutes=10),
+    "old.ppy.sh/u/": datetime.timedelta(hours=1),
+    "api.tillerino.org/beatmaps/byHash/": requests_cache.DO_NOT_CACHE,
+}
+http_cache_size = int(os.environ.get("HTTP_CACHE_MB", 256)) * 1024 ** 2
+sess = CountingSession(
+    os.path.join(data_dir, "http_cache.sqlite"),
+    backend="sqlite",
+    wal=True,
+    expire_after=datetime.timedelta(minutes=5),
+    urls_expire_after=http_ttls,
+    # Keep the API key out of cache keys and the database.
+    ignored_parameters=[*requests_cache.DEFAULT_IGNORED_PARAMS, "k"],
+    max_size=http_cache_size,
+)
 osu_key = os.environ["OSU_API_KEY"]
-osu_api = osuapi.OsuApi(osu_key, connector=osuapi.ReqConnector(sess=sess))
+# Concurrent identical API calls share one request.
+osu_api = SingleFlightProxy(
+    osuapi.OsuApi(osu_key, connector=osuapi.ReqConnector(sess=sess))
+)
 tillerino_key = os.environ["TILLERINO_API_KEY"]
 osu_url = "https://osu.ppy.sh"
 old_url = "https://old.ppy.sh"
@@ -19,6 +59,7 @@ reddit_user = os.environ.get("REDDIT_USER", "osu-bot")
 reddit_password = os.environ["REDDIT_PASSWORD"]
 reddit_client_id = os.environ["REDDIT_CLIENT_ID"]
 reddit_client_secret = os.environ["REDDIT_CLIENT_SECRET"]
+reddit_pool_size = int(os.environ.get("REDDIT_POOL_SIZE", 10))
 
 # Regex stuff
 title_re = re.compile(".+[\|丨].+-.+\[.+\]")
@@ -158,6 +199,45 @@ mod_order = [
 ignore_mods = [mods2int[m] for m in ["SD", "PF", "RX", "AT", "AP", "V2"]]
 samediffmods = [mods2int[m] for m in ["TD", "HD", "FL", "NF"]]
 
+# Concurrency stuff
+lookup_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("LOOKUP_WORKERS", 8)),
+    thread_name_prefix="lookup",
+)
+render_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("RENDER_WORKERS", 8)),
+    thread_name_prefix="render",
+)
+parallel_render = os.environ.get("PARALLEL_RENDER", "True") == "True"
+section_timeout = float(os.environ.get("SECTION_TIMEOUT", 30))  # Seconds.
+job_workers = int(os.environ.get("JOB_WORKERS", 2))
+job_attempts = int(os.environ.get("JOB_ATTEMPTS", 3))
+job_backoff = float(os.environ.get("JOB_BACKOFF", 30))  # Seconds.
+# Seconds before a running job is assumed lost, longer than any job takes.
+job_lease = float(os.environ.get("JOB_LEASE", 600))
+job_queue_limit = int(os.environ.get("JOB_QUEUE_LIMIT", 100))
+
+# Cache stuff
+beatmap_cache_size = int(os.environ.get("BEATMAP_CACHE_MB", 256)) * 1024 ** 2
+attr_store_path = os.path.join(data_dir, "attributes.sqlite")
+job_queue_path = os.path.join(data_dir, "jobs.sqlite")
+attr_store_entries = int(os.environ.get("ATTR_STORE_ENTRIES", 100000))
+# Stored attributes are dropped when this changes, so bump the number after
+# changing how they're computed.
+attr_store_version = "rosu-pp-py %s, 1" % importlib.metadata.version("rosu-pp-py")
+beatmap_meta_entries = 10000
+beatmap_meta_ttl = 60 * 60  # 1 hour.
+beatmap_index_entries = 100000
+leaderboard_entries = 1000
+leaderboard_ttl = 10 * 60  # 10 minutes.
+mapper_profile_entries = 10000
+mapper_profile_ttl = int(os.environ.get("MAPPER_PROFILE_TTL", 6 * 60 * 60))  # Seconds.
+missing_beatmap_entries = 10000
+missing_beatmap_ttl = int(os.environ.get("MISSING_BEATMAP_TTL", 30 * 60))  # Seconds.
+beatmap_dir = os.path.join(data_dir, "beatmaps")
+beatmap_store_size = int(os.environ.get("BEATMAP_STORE_MB", 1024)) * 1024 ** 2
+beatmap_store_compress = os.environ.get("BEATMAP_STORE_COMPRESS") == "True"
+
 # Markdown/HTML stuff
 bar = "&#124;"  # Vertical bar.
 spc = "&nbsp;"  # Non-breaking space.
@@ -1,19 +1,55 @@
-from . import consts
+from . import consts, mappers
+from .records import Beatmap, Player, first
 from .beatmap_search import search, search_events
 from .utils import combine_mods, map_str, matched_bracket_contents, safe_call
 
 
 class Context:
-    """A container for all relevant data."""
+    """
+    A container for all relevant data.
+    Contexts are immutable: use evolve to derive one with different values.
+    """
 
-    def __init__(self, player, beatmap, mode, mods, acc, guest_mapper, logs):
-        self.player = player  # osuapi.models.User, None if missing
-        self.beatmap = beatmap  # osuapi.models.Beatmap, None if missing
-        self.mode = mode  # Int (0-4), None if missing
-        self.mods = mods  # Int, 0 if missing
-        self.acc = acc  # Float (0-100), None if missing
-        self.guest_mapper = guest_mapper  # osuapi.models.User, None if missing
-        self.logs = logs  # List of strings
+    __slots__ = [
+        "player",
+        "beatmap",
+        "mode",
+        "mods",
+        "acc",
+        "guest_mapper",
+        "logs",
+        "pages",
+    ]
+
+    def __init__(
+        self, player, beatmap, mode, mods, acc, guest_mapper, logs, pages=None
+    ):
+        init = object.__setattr__
+        init(self, "player", player)  # records.Player or None
+        init(self, "beatmap", beatmap)  # records.Beatmap or None
+        init(self, "mode", mode)  # Int (0-4), None if missing
+        init(self, "mods", mods)  # Int, 0 if missing
+        init(self, "acc", acc)  # Float (0-100), None if missing
+        init(self, "guest_mapper", guest_mapper)  # records.Player or None
+        init(self, "logs", logs)  # List of strings
+        # (Page type, ID) -> scraped values, see scrape.py
+        init(self, "pages", {} if pages is None else pages)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Context is immutable, use evolve instead")
+
+    def __delattr__(self, name):
+        raise AttributeError("Context is immutable")
+
+    def evolve(self, **changes):
+        """
+        Derive a new context with some values changed.
+        Everything else is shared with this context, including logs and
+        scraped pages, unless it's replaced.
+        """
+        values = {k: getattr(self, k) for k in self.__slots__}
+        values.update(changes)
+        return Context(**values)
 
     def __repr__(self):
         mode = "Unknown" if self.mode is None else consts.mode2str[self.mode]
@@ -49,41 +85,57 @@ class Context:
 
 
 def from_score_post(title):
-    """Construct a Context from the title of score post."""
+    """
+    Construct a Context from the title of score post.
+    Independent API lookups run concurrently, so this only waits on
+    lookups that need the results of others.
+    """
     logs = []
+    guest_mapper = consts.lookup_pool.submit(getguestmapper, title)
     player = getplayer(title, logs=logs)
     beatmap = getmap(title, player=player, logs=logs)
     mode = getmode(title, player=player, beatmap=beatmap)
     mods = getmods(title)
     logs.append("osr2mp4-mods: %s" % combine_mods(mods))
     acc = getacc(title)
-    guest_mapper = getguestmapper(title)
 
     # Once we know the game mode, we can ensure that the player and map
     # are of the right mode (this really helps with autoconverts).
     if mode is not None and mode != consts.std:
-        match = consts.player_re.search(title)
-        if match:
-            name = strip_annots(match.group(1))
-            updated_players = safe_call(
-                consts.osu_api.get_user,
-                player.user_id if player else name,
-                mode=consts.int2osuapimode[mode],
-            )
-            if updated_players:
-                player = updated_players[0]
-
-        if beatmap is not None and beatmap.mode.value == consts.std:
-            updated_beatmaps = safe_call(
-                consts.osu_api.get_beatmaps,
-                beatmap_id=beatmap.beatmap_id,
-                mode=consts.int2osuapimode[mode],
-                include_converted=True,
-            )
-            if updated_beatmaps:
-                beatmap = updated_beatmaps[0]
-
-    return Context(player, beatmap, mode, mods, acc, guest_mapper, logs)
+        updated_player = consts.lookup_pool.submit(
+            getplayer_mode, title, mode, player=player
+        )
+        beatmap = getmap_mode(beatmap, mode)
+        player = updated_player.result()
+
+    return Context(player, beatmap, mode, mods, acc, guest_mapper.result(), logs)
+
+
+def getplayer_mode(title, mode, player=None):
+    """Get the player for a specific game mode, falling back to player."""
+    match = consts.player_re.search(title)
+    if not match:
+        return player
+    name = strip_annots(match.group(1))
+    updated_players = safe_call(
+        consts.osu_api.get_user,
+        player.user_id if player else name,
+        mode=consts.int2osuapimode[mode],
+    )
+    return first(updated_players, Player) or player
+
+
+def getmap_mode(beatmap, mode):
+    """Get the beatmap converted to a specific game mode, if applicable."""
+    if beatmap is None or beatmap.mode != consts.std:
+        return beatmap
+    updated_beatmaps = safe_call(
+        consts.osu_api.get_beatmaps,
+        beatmap_id=beatmap.beatmap_id,
+        mode=consts.int2osuapimode[mode],
+        include_converted=True,
+    )
+    return first(updated_beatmaps, Beatmap) or beatmap
 
 
 def getplayer(title, logs=[]):
@@ -96,7 +148,7 @@ def getplayer(title, logs=[]):
 
     players = safe_call(consts.osu_api.get_user, name)
     if players:
-        return players[0]
+        return Player.from_api(players[0])
     logs.append("Player: '%s' not found" % name)
     return None
 
@@ -158,7 +210,7 @@ def getmode(title, player=None, beatmap=None):
             m = search_events(player, "", b_id=beatmap.beatmap_id, mode=True)
             if m is not None:
                 return m
-        return beatmap.mode.value
+        return beatmap.mode
 
     return None
 
@@ -229,11 +281,9 @@ def getguestmapper(title):
         return None
 
     players = safe_call(consts.osu_api.get_user, guest)
-    if players:
-        player = players[0]
-    else:
+    if not players:
         return None
 
     # Only return the guest mapper if they have at least one map of their own.
-    maps = safe_call(consts.osu_api.get_beatmaps, username=player.username)
-    return player if maps else None
+    profile = mappers.profile(players[0].user_id, user=players[0])
+    return Player.from_api(players[0]) if profile and profile["sets"] else None
@@ -1,6 +1,6 @@
 import rosu_pp_py as rosu
 
-from . import consts, scrape
+from . import consts, scrape, store
 from .utils import changes_diff, is_ignored
 
 
@@ -32,12 +32,15 @@ def diff_modded(ctx):
     """Get the modded difficulty values of a map."""
     if is_ignored(ctx.mods):
         return None
-    path = scrape.download_beatmap(ctx)
-    if path is None:
-        return None
-    bm = rosu.Beatmap(path=path)
-    diff = rosu.Difficulty(mods=ctx.mods)
-    result = diff.calculate(bm)
+    md5 = ctx.beatmap.file_md5
+    result = store.attributes.get(md5, ctx.mods, None)
+    if not all(k in result for k in ["sr", "ar", "od", "hp"]):
+        bm = scrape.parse_beatmap(ctx)
+        if bm is None:
+            return None
+        attrs = rosu.Difficulty(mods=ctx.mods).calculate(bm)
+        result = {"sr": attrs.stars, "ar": attrs.ar, "od": attrs.od, "hp": attrs.hp}
+        store.attributes.update(md5, ctx.mods, None, **result)
     if ctx.mods & consts.mods2int["DT"]:  # This catches NC too.
         scalar = 1.5
     elif ctx.mods & consts.mods2int["HT"]:
@@ -47,7 +50,7 @@ def diff_modded(ctx):
     bpm = ctx.beatmap.bpm * scalar
     length = round(ctx.beatmap.total_length / scalar)
     if changes_diff(ctx.mods):
-        stars = result.stars
+        stars = result["sr"]
     else:
         stars = ctx.beatmap.difficultyrating
     # https://redd.it/6phntt
@@ -58,9 +61,9 @@ def diff_modded(ctx):
         cs /= 2
     return {
         "cs": cs,
-        "ar": result.ar,
-        "od": result.od,
-        "hp": result.hp,
+        "ar": result["ar"],
+        "od": result["od"],
+        "hp": result["hp"],
         "sr": stars,
         "bpm": bpm,
         "length": length,
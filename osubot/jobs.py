@@ -0,0 +1,212 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+
+class JobQueue:
+    """
+    A persistent queue of score post jobs, stored in SQLite.
+    Jobs are keyed by post ID, so each post is only queued once unless it
+    failed for good, or only had test runs so far. Failed attempts are
+    retried up to max_attempts times, waiting backoff seconds at first and
+    twice as long after each failure.
+    Running jobs that haven't been updated in lease seconds are assumed to
+    belong to a process that died, and are queued again.
+    """
+
+    def __init__(self, path, max_attempts=3, backoff=30, lease=600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.conn = None
+
+    def connect(self):
+        """Open the database, creating it if necessary."""
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, timeout=10, check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, test INTEGER, state TEXT,
+                    attempts INTEGER, run_at REAL, status INTEGER, result TEXT,
+                    created REAL, updated REAL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS jobs_run_at
+                ON jobs (state, run_at)
+                """
+            )
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def enqueue(self, p_id, test=False):
+        """
+        Queue a job for a post, unless one is already queued, running or done.
+        A real job replaces a test job in any state. Returns the job.
+        """
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                """
+                INSERT INTO jobs
+                VALUES (?, ?, 'queued', 0, ?, NULL, NULL, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    test = excluded.test, state = 'queued', attempts = 0,
+                    run_at = excluded.run_at, status = NULL, result = NULL,
+                    updated = excluded.updated
+                WHERE state = 'failed' OR (jobs.test AND NOT excluded.test)
+                """,
+                (p_id, int(test), now, now, now),
+            )
+            conn.commit()
+        self.wakeup.set()
+        return self.get(p_id)
+
+    def claim(self):
+        """Take the next job that's due, or return None if there isn't one."""
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT * FROM jobs WHERE state = 'queued' AND run_at <= ?
+                ORDER BY run_at LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            conn.execute(
+                """
+                UPDATE jobs SET state = 'running', attempts = attempts + 1,
+                updated = ? WHERE id = ?
+                """,
+                (now, row["id"]),
+            )
+            conn.commit()
+        return dict(row, attempts=row["attempts"] + 1)
+
+    def finish(self, job, body, status, retry=False):
+        """Record a job's result, and requeue it if it should be retried."""
+        now = time.time()
+        if retry and job["attempts"] < self.max_attempts:
+            state = "queued"
+            run_at = now + self.backoff * 2 ** (job["attempts"] - 1)
+        else:
+            state = "failed" if retry else "done"
+            run_at = job["run_at"]
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                """
+                UPDATE jobs SET state = ?, run_at = ?, status = ?, result = ?,
+                updated = ? WHERE id = ? AND test = ?
+                """,
+                (
+                    state,
+                    run_at,
+                    status,
+                    json.dumps(body),
+                    now,
+                    job["id"],
+                    int(job["test"]),
+                ),
+            )
+            conn.commit()
+
+    def get(self, p_id):
+        """Get a job by post ID, or None."""
+        with self.lock:
+            row = (
+                self.connect()
+                .execute("SELECT * FROM jobs WHERE id = ?", (p_id,))
+                .fetchone()
+            )
+        if row is None:
+            return None
+        job = dict(row)
+        job["test"] = bool(job["test"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def depth(self):
+        """Count the jobs that are queued or running."""
+        with self.lock:
+            (n,) = (
+                self.connect()
+                .execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')")  # noqa
+                .fetchone()
+            )
+        return n
+
+    def recover(self):
+        """Requeue running jobs whose lease has expired."""
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                """
+                UPDATE jobs SET state = 'queued'
+                WHERE state = 'running' AND updated < ?
+                """,
+                (time.time() - self.lease,),
+            )
+            conn.commit()
+
+    def start(self, process, workers, poll=1):
+        """
+        Start worker threads that run process(p_id, test) for each job.
+        process returns a (body, status) pair; 5xx statuses are retried.
+        """
+        self.recover()
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self.work,
+                args=(process, poll),
+                name="job-worker-%d" % i,
+                daemon=True,
+            )
+            thread.start()
+
+    def work(self, process, poll):
+        """Process jobs forever."""
+        while True:
+            try:
+                job = self.claim()
+                if job is None:
+                    self.recover()
+            except Exception as e:
+                print("Claiming job failed: %s" % e)
+                job = None
+            if job is None:
+                self.wakeup.wait(poll)
+                self.wakeup.clear()
+                continue
+
+            print("Job %s: attempt %d" % (job["id"], job["attempts"]))
+            try:
+                body, status = process(job["id"], job["test"])
+            except Exception as e:
+                traceback.print_exc(file=sys.stdout)
+                body, status = {"error": str(e)}, 500
+            try:
+                self.finish(job, body, status, retry=status >= 500)
+            except Exception as e:
+                print("Finishing job %s failed: %s" % (job["id"], e))
@@ -0,0 +1,29 @@
+from . import consts
+from .cache import LRUCache
+from .utils import safe_call
+
+# Top scores keyed by (beatmap ID, mode).
+leaderboards = LRUCache(consts.leaderboard_entries, ttl=consts.leaderboard_ttl)
+
+
+def top_scores(beatmap_id, mode):
+    """
+    Get the top 100 scores on a beatmap in a game mode (standard if None).
+    Returns None if the lookup failed.
+    """
+    if mode is None:
+        mode = consts.std
+    key = (beatmap_id, mode)
+    scores = leaderboards.get(key)
+    if scores is not None:
+        return scores
+
+    scores = safe_call(
+        consts.osu_api.get_scores,
+        beatmap_id,
+        mode=consts.int2osuapimode[mode],
+        limit=100,
+    )
+    if scores is not None:
+        leaderboards.put(key, scores)
+    return scores
@@ -0,0 +1,61 @@
+from . import consts
+from .cache import LRUCache
+from .utils import safe_call
+
+# Mapper profiles, keyed by both user ID and lowercase username.
+profiles = LRUCache(consts.mapper_profile_entries, ttl=consts.mapper_profile_ttl)
+
+
+def profile(mapper, user=None):
+    """
+    Get a mapper's user ID, current username, and number of beatmapsets
+    per status. mapper is a user ID (int) or username, and user is their
+    API user if it's already been looked up.
+    Returns None if the mapper can't be found.
+    """
+    key = profile_key(mapper)
+    cached = profiles.get(key)
+    if cached is not None:
+        return cached
+
+    if user is None:
+        users = safe_call(consts.osu_api.get_user, mapper)
+        user = users[0] if users else None
+        if users is None:  # Don't cache failed lookups.
+            key = None
+    maps = safe_call(
+        consts.osu_api.get_beatmaps,
+        username=user.user_id if user else mapper,
+    )
+    if maps is None:
+        key = None
+    if not maps and user is None:
+        return None
+
+    result = {
+        "user_id": user.user_id if user else None,
+        "username": user.username if user else None,
+        "sets": 0,
+        "counts": {k: 0 for k in consts.status2str},
+    }
+    # Diffs of a set share a status, so only count the first of each set.
+    sets = {}
+    for m in maps or []:
+        sets.setdefault(m.beatmapset_id, m.approved.value)
+    result["sets"] = len(sets)
+    for approved in sets.values():
+        status = consts.int2status.get(approved)
+        if status in result["counts"]:
+            result["counts"][status] += 1
+
+    if key is not None:
+        profiles.put(key, result)
+        if user:
+            profiles.put(profile_key(user.user_id), result)
+            profiles.put(profile_key(user.username), result)
+    return result
+
+
+def profile_key(mapper):
+    """Normalize a user ID or username into a cache key."""
+    return mapper if isinstance(mapper, int) else str(mapper).lower()
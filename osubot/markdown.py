@@ -1,8 +1,11 @@
-import copy
 import markdown_strings as md
 import random
+import time
 
-from . import consts, diff, pp, scrape
+from concurrent.futures import TimeoutError
+
+from . import consts, diff, leaderboards, mappers, pp, scrape
+from .records import Beatmap, Player
 from .utils import (
     accuracy,
     combine_mods,
@@ -16,21 +19,67 @@ from .utils import (
 )
 
 
-def build_comment(ctx):
-    """Build a full comment from ctx."""
+def build_comment(ctx, parallel=None):
+    """
+    Build a full comment from ctx.
+    If parallel is set (the default comes from the environment), the
+    sections are rendered concurrently.
+    """
     if not ctx.player and not ctx.beatmap:
         return None
+    if parallel is None:
+        parallel = consts.parallel_render
 
-    comment = "\n\n".join(
-        filter(
-            bool,
-            [map_header(ctx), map_table(ctx), player_table(ctx), "***", footer(ctx)],
-        )
-    )
+    sections = [map_header, map_table, player_table]
+    if parallel:
+        rendered = render_parallel(ctx, sections)
+    else:
+        rendered = [f(ctx) for f in sections]
+
+    # The footer contains the logs, so it has to come last.
+    comment = "\n\n".join(filter(bool, rendered + ["***", footer(ctx)]))
 
     return None if comment.startswith("***") else comment
 
 
+def render_parallel(ctx, sections):
+    """
+    Render sections concurrently, keeping their order.
+    Any section that runs for longer than the timeout is left out.
+    Each section's time starts when it does, so time spent waiting for a
+    worker doesn't count against it.
+    """
+    started = {}  # Section -> start time.
+
+    def render(f):
+        started[f] = time.time()
+        return f(ctx)
+
+    futures = [consts.render_pool.submit(render, f) for f in sections]
+
+    rendered = []
+    for f, future in zip(sections, futures):
+        while True:
+            start = started.get(f)
+            if start is None:
+                timeout = consts.section_timeout
+            else:
+                timeout = max(start + consts.section_timeout - time.time(), 0)
+            try:
+                rendered.append(future.result(timeout=timeout))
+                break
+            except TimeoutError:
+                if start is None:  # Still waiting for a worker.
+                    continue
+                future.cancel()
+                print("Section %s timed out" % f.__name__)
+                ctx.logs.append("%s: Timed out" % f.__name__)
+                rendered.append(None)
+                break
+
+    return rendered
+
+
 def map_header(ctx):
     """Return a line or two with basic map information."""
     if not ctx.beatmap:
@@ -68,7 +117,7 @@ def map_header(ctx):
 
     tokens = [map_s]
 
-    unranked = consts.int2status[b.approved.value] == "Unranked"
+    unranked = consts.int2status[b.approved] == "Unranked"
 
     if not unranked and ctx.mode is not None:
         tokens.append(consts.mode2str[ctx.mode])
@@ -91,7 +140,7 @@ def approved_subheader(ctx):
     if max_combo is not None:
         tokens.append("%sx max combo" % sep(max_combo))
 
-    status = consts.int2status[ctx.beatmap.approved.value]
+    status = consts.int2status[ctx.beatmap.approved]
     if ctx.beatmap.approved_date is not None and status != "Qualified":
         status += " (%d)" % ctx.beatmap.approved_date.year
     tokens.append(status)
@@ -153,18 +202,13 @@ def map_table(ctx):
             ["Length", s_to_ts(nomod["length"])],
         ]
 
-    pp_vals = {}
-    for acc in filter(bool, set([95, 98, 99, 100, ctx.acc])):
-        nomod_pp = pp.pp_val(ctx, acc, modded=False)
-        if nomod_pp is None:
-            continue
+    accs = sorted(filter(bool, set([95, 98, 99, 100, ctx.acc])))
+    mods_list = [consts.nomod, ctx.mods] if modded else [consts.nomod]
+    ladder = pp.pp_ladder(ctx, accs, mods_list)
 
-        if modded:
-            modded_pp = pp.pp_val(ctx, acc, modded=True)
-            if modded_pp is not None:
-                pp_vals[acc] = nomod_pp, modded_pp
-        else:
-            pp_vals[acc] = nomod_pp, None
+    pp_vals = {}
+    for acc, row in zip(accs, ladder or []):
+        pp_vals[acc] = row[0], row[1] if modded else None
 
     accs_joined = (" %s " % consts.bar).join(
         (
@@ -232,15 +276,14 @@ def player_table(ctx):
             include_converted=True,
         )
         if beatmaps:
-            bmap = beatmaps[0]
+            bmap = Beatmap.from_api(beatmaps[0])
             map_url = "%s/b/%d" % (consts.osu_url, bmap.beatmap_id)
             if ctx.mode is not None:
                 map_url += "?m=%d" % ctx.mode
 
-            ctx_clone = copy.deepcopy(ctx)
-            ctx_clone.beatmap = bmap
-            ctx_clone.mods = score.enabled_mods.value
-            ctx_clone.mode = mode
+            ctx_clone = ctx.evolve(
+                beatmap=bmap, mods=score.enabled_mods.value, mode=mode, logs=[]
+            )
             hover = map_hover(ctx_clone, oldmap=ctx.beatmap, oldmods=ctx.mods)
 
             if hover:
@@ -277,7 +320,7 @@ def footer(ctx):
     #         consts.unnoticed,
     #     ))
 
-    exp_pp = bool(ctx.beatmap) and ctx.beatmap.mode.value != ctx.mode
+    exp_pp = bool(ctx.beatmap) and ctx.beatmap.mode != ctx.mode
     exp_pp |= ctx.mode in [consts.ctb, consts.mania]
     if exp_pp:
         if ctx.mode == consts.taiko:
@@ -301,9 +344,7 @@ def map_rank_one(ctx):
 
     mode = ctx.mode if ctx.mode is not None else consts.std
     apimode = consts.int2osuapimode[mode]
-    scores = safe_call(
-        consts.osu_api.get_scores, ctx.beatmap.beatmap_id, mode=apimode, limit=2,
-    )
+    scores = leaderboards.top_scores(ctx.beatmap.beatmap_id, mode)
     if not scores:
         return None
     score = scores[0]
@@ -316,8 +357,7 @@ def map_rank_one(ctx):
 
     players = safe_call(consts.osu_api.get_user, score.user_id, mode=apimode)
     if players:
-        ctx_clone = copy.deepcopy(ctx)
-        ctx_clone.player = players[0]
+        ctx_clone = ctx.evolve(player=Player.from_api(players[0]), logs=[])
         hover = player_hover(ctx_clone, oldplayer=ctx.player)
     else:
         hover = None
@@ -347,18 +387,10 @@ def mapper_counts(ctx, mapper=None):
         mapper_id = scrape.mapper_id(ctx)
         mapper = ctx.beatmap.creator if mapper_id is None else mapper_id
 
-    maps = safe_call(consts.osu_api.get_beatmaps, username=mapper)
-    if not maps:
+    profile = mappers.profile(mapper)
+    if not profile or not profile["sets"]:
         return None
-
-    groups = {k: 0 for k in consts.status2str}
-    ids = []
-    for b in [(m.beatmapset_id, m.approved.value) for m in maps]:
-        if b[0] in ids:
-            continue
-        ids.append(b[0])
-        if consts.int2status.get(b[1]) in groups:
-            groups[consts.int2status[b[1]]] += 1
+    groups = profile["counts"]
 
     return "%s ranked, %s qualified, %s loved, %s unranked" % tuple(
         sep(groups[k]) for k in ["Ranked", "Qualified", "Loved", "Unranked"]
@@ -372,9 +404,10 @@ def mapper_renamed(ctx, mapper_id=None):
         if mapper_id is None:
             return None
 
-    mapper_updated = safe_call(consts.osu_api.get_user, mapper_id)
-    if mapper_updated and mapper_updated[0].username != ctx.beatmap.creator:
-        return mapper_updated[0].username
+    profile = mappers.profile(mapper_id)
+    username = profile["username"] if profile else None
+    if username and username != ctx.beatmap.creator:
+        return username
 
     return None
 
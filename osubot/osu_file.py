@@ -0,0 +1,78 @@
+import mmap
+
+# Hitobject type bits.
+circle, slider, spinner, hold = 1 << 0, 1 << 1, 1 << 3, 1 << 7
+
+
+def section_lines(source, name):
+    """
+    Iterate over the lines of one section of a .osu file, as bytes.
+    source is a path or the file's contents. Files are memory-mapped, so only
+    the section itself is ever read. Blank lines and comments are skipped.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        yield from buffer_lines(source, name)
+        return
+    with open(source, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file.
+            return
+    with mm:
+        yield from buffer_lines(mm, name)
+
+
+def buffer_lines(buf, name):
+    """Iterate over the lines of one section of a .osu file in a buffer."""
+    start = find_header(buf, b"[%s]" % name.encode())
+    if start == -1:
+        return
+    pos = buf.find(b"\n", start)
+    while pos != -1:
+        end = buf.find(b"\n", pos + 1)
+        line = buf[pos + 1 : len(buf) if end == -1 else end].strip()
+        if line.startswith(b"["):  # The next section.
+            return
+        if line and not line.startswith(b"//"):
+            yield line
+        pos = end
+
+
+def find_header(buf, header):
+    """Find a section header at the start of a line, or return -1."""
+    start = buf.find(header)
+    while start > 0 and buf[start - 1 : start] not in [b"\n", b"\r"]:
+        start = buf.find(header, start + 1)
+    return start
+
+
+def section_values(source, name):
+    """Get the key/value pairs of a section like [General] or [Difficulty]."""
+    values = {}
+    for line in section_lines(source, name):
+        key, sep, value = line.decode("utf-8", "replace").partition(":")
+        if sep:
+            values[key.strip()] = value.strip()
+    return values
+
+
+def count_objects(source):
+    """Count the hitobjects of each type in a .osu file."""
+    counts = {"circle": 0, "slider": 0, "spinner": 0, "hold": 0}
+    for line in section_lines(source, "HitObjects"):
+        fields = line.split(b",", 4)
+        if len(fields) < 4:
+            continue
+        try:
+            kind = int(fields[3])
+        except ValueError:
+            continue
+        if kind & slider:
+            counts["slider"] += 1
+        elif kind & spinner:
+            counts["spinner"] += 1
+        elif kind & hold:
+            counts["hold"] += 1
+        elif kind & circle:
+            counts["circle"] += 1
+    return counts
@@ -1,17 +1,52 @@
 import rosu_pp_py as rosu
 
-from . import consts, scrape
+from . import consts, scrape, store
 
 
 def pp_val(ctx, acc, modded=True):
     """Get pp earned for a play with given acc."""
-    if ctx.mode is None:
-        return None
-    path = scrape.download_beatmap(ctx)
-    if path is None:
-        return None
-    bm = rosu.Beatmap(path=path)
-    bm.convert(consts.int2rosumode[ctx.mode])
     mods = ctx.mods if modded else consts.nomod
-    perf = rosu.Performance(mods=mods, accuracy=acc)
-    return perf.calculate(bm).pp
+    ladder = pp_ladder(ctx, [acc], [mods])
+    return None if ladder is None else ladder[0][0]
+
+
+def pp_ladder(ctx, accs, mods_list):
+    """
+    Get pp earned for plays with every combination of accs and mods_list.
+    Returns a matrix where ladder[i][j] is the pp for accs[i] and mods_list[j].
+    """
+    if ctx.mode is None or not ctx.beatmap:
+        return None
+    md5 = ctx.beatmap.file_md5
+    keys = ["%.2f" % acc for acc in accs]
+
+    ladder = [[None] * len(mods_list) for _ in accs]
+    bm = None
+    for j, mods in enumerate(mods_list):
+        stored = store.attributes.get(md5, mods, ctx.mode).get("pp", {})
+        if all(k in stored for k in keys):
+            for i, k in enumerate(keys):
+                ladder[i][j] = stored[k]
+            continue
+
+        if bm is None:
+            bm = scrape.parse_beatmap(ctx, mode=ctx.mode)
+            if bm is None:
+                return None
+        # Difficulty attributes don't depend on accuracy, so compute them once.
+        attrs = rosu.Difficulty(mods=mods).calculate(bm)
+        perf = rosu.Performance(mods=mods)
+        for i, acc in enumerate(accs):
+            perf.set_accuracy(acc)
+            ladder[i][j] = perf.calculate(attrs).pp
+
+        store.attributes.update(
+            md5,
+            mods,
+            ctx.mode,
+            sr=attrs.stars,
+            max_combo=attrs.max_combo,
+            pp={k: ladder[i][j] for i, k in enumerate(keys)},
+        )
+
+    return ladder
@@ -0,0 +1,94 @@
+class Record:
+    """
+    A lightweight record holding only the fields we use from an API model.
+    Subclasses list their fields in __slots__.
+    """
+
+    __slots__ = []
+
+    def __init__(self, **values):
+        for k in self.__slots__:
+            setattr(self, k, values.get(k))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__
+        )
+
+    def __repr__(self):
+        fields = ["%s=%r" % (k, getattr(self, k)) for k in self.__slots__]
+        return "%s(%s)" % (type(self).__name__, ", ".join(fields))
+
+    @classmethod
+    def from_api(cls, model):
+        """Copy the fields from an osuapi model, with None for missing ones."""
+        return cls(**{k: getattr(model, k, None) for k in cls.__slots__})
+
+
+class Event(Record):
+    """A player event, from osuapi.models.UserEvent."""
+
+    __slots__ = ["beatmap_id", "display_html"]
+
+
+class Player(Record):
+    """A player, from osuapi.models.User."""
+
+    __slots__ = [
+        "user_id",
+        "username",
+        "pp_raw",
+        "pp_rank",
+        "pp_country_rank",
+        "country",
+        "accuracy",
+        "playcount",
+        "events",  # Tuple of Events
+    ]
+
+    def __str__(self):
+        return self.username
+
+    @classmethod
+    def from_api(cls, model):
+        player = super().from_api(model)
+        player.events = tuple(Event.from_api(e) for e in model.events or [])
+        return player
+
+
+class Beatmap(Record):
+    """A beatmap, from osuapi.models.Beatmap."""
+
+    __slots__ = [
+        "beatmap_id",
+        "beatmapset_id",
+        "file_md5",
+        "artist",
+        "title",
+        "version",
+        "creator",
+        "mode",  # Int (0-3)
+        "approved",  # Int, see consts.int2status
+        "approved_date",
+        "playcount",
+        "max_combo",
+        "diff_size",
+        "diff_approach",
+        "diff_overall",
+        "diff_drain",
+        "difficultyrating",
+        "bpm",
+        "total_length",
+    ]
+
+    @classmethod
+    def from_api(cls, model):
+        beatmap = super().from_api(model)
+        beatmap.mode = model.mode.value
+        beatmap.approved = model.approved.value
+        return beatmap
+
+
+def first(models, cls):
+    """Convert the first of some API models to a record, or return None."""
+    return cls.from_api(models[0]) if models else None
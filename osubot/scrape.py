@@ -1,62 +1,200 @@
-import os.path
+import rosu_pp_py as rosu
 
-from . import consts
+from . import consts, leaderboards, osu_file, store
+from .cache import LRUCache, SingleFlight
 from .utils import request, s3_zipped_download, s3_zipped_upload, safe_call
 
 tillerino_api = "https://api.tillerino.org"
+# Parsed beatmaps keyed by (file_md5, mode), sized by their .osu file size.
+parsed_beatmaps = LRUCache(consts.beatmap_cache_size)
+# Beatmaps that couldn't be downloaded recently, keyed by (beatmap_id, file_md5).
+missing_beatmaps = LRUCache(
+    consts.missing_beatmap_entries, ttl=consts.missing_beatmap_ttl
+)
+beatmap_flights = SingleFlight()
+parse_flights = SingleFlight()
 
 
 def download_beatmap(ctx):
-    """Download a .osu file."""
+    """
+    Download a .osu file. Returns its contents as bytes.
+    Concurrent downloads of the same beatmap share one download.
+    """
     if not ctx.beatmap:
         return None
+    key = (ctx.beatmap.beatmap_id, ctx.beatmap.file_md5)
+    data = beatmap_flights.do(key, fetch_beatmap, ctx)
+    if data is None:
+        not_downloaded(ctx)
+    return data
+
+
+def fetch_beatmap(ctx):
+    """Get a .osu file from the store, S3, osu!web, or Tillerino."""
+    md5 = ctx.beatmap.file_md5
+    data = store.beatmaps.get(md5)
+    if data is not None:
+        return data
+
+    key = (ctx.beatmap.beatmap_id, md5)
+    if key in missing_beatmaps:
+        return None
 
-    osu_path = "/tmp/%s.osu" % ctx.beatmap.file_md5
-    if os.path.isfile(osu_path):
-        return osu_path
-
-    s3_key = "osu/%s.zip" % ctx.beatmap.file_md5
-    if s3_zipped_download(s3_key) and os.path.isfile(osu_path):
+    s3_key = "osu/%s.zip" % md5
+    data = s3_zipped_download(s3_key)
+    if data:
         ctx.logs.append(".osu: Downloaded from S3")
-        return osu_path
+        store.beatmaps.put(md5, data)
+        return data
 
-    text = request("%s/osu/%d" % (consts.old_url, ctx.beatmap.beatmap_id))
-    if text:
+    url = "%s/osu/%d" % (consts.old_url, ctx.beatmap.beatmap_id)
+    resp = request(url, text=False)
+    if resp is not None:
         ctx.logs.append(".osu: Downloaded from osu!web")
     else:
-        text = request(
+        resp = request(
             "%s/beatmaps/byHash/%s/file?k=%s"
-            % (tillerino_api, ctx.beatmap.file_md5, consts.tillerino_key),
+            % (tillerino_api, md5, consts.tillerino_key),
+            text=False,
         )
-        if text:
+        if resp is not None:
             ctx.logs.append(".osu: Downloaded from Tillerino")
-    if not text:
+    if resp is None:
+        print("Beatmap %d (%s) is not downloadable" % key)
+        missing_beatmaps.put(key, True)
+        return None
+    data = resp.content
+
+    # Store the beatmap for next time.
+    if store.beatmaps.put(md5, data) and s3_zipped_upload(s3_key, "%s.osu" % md5, data):
+        ctx.logs.append(".osu: Uploaded to S3")
+
+    return data
+
+
+def not_downloaded(ctx):
+    """Log a failed download, once per context."""
+    if ".osu: Not downloaded" not in ctx.logs:
         ctx.logs.append(".osu: Not downloaded")
+
+
+def beatmap_text(data):
+    """Decode a .osu file, dropping anything before the header."""
+    text = data.decode("utf-8", "replace")
+    return consts.osu_file_begin_re.sub("osu file format", text)
+
+
+def parse_beatmap(ctx, mode=None):
+    """
+    Get a parsed beatmap, converted to mode unless it's None.
+    Each beatmap is parsed at most once per mode while it stays cached,
+    and concurrent parses of the same beatmap and mode share one parse.
+    """
+    if not ctx.beatmap:
         return None
 
-    text = consts.osu_file_begin_re.sub("osu file format", text)
+    md5 = ctx.beatmap.file_md5
+    bm = parsed_beatmaps.get((md5, mode))
+    if bm is not None:
+        return bm
+    return parse_flights.do((md5, mode), convert_beatmap, ctx, mode)
 
-    with open(osu_path, "w") as f:
-        f.write(text)
 
-    # Store the beatmap for next time.
-    if s3_zipped_upload(s3_key, os.path.basename(osu_path), text):
-        ctx.logs.append(".osu: Uploaded to S3")
+def convert_beatmap(ctx, mode):
+    """Parse a beatmap and convert it to mode, caching the results."""
+    md5 = ctx.beatmap.file_md5
+    bm = parsed_beatmaps.get((md5, mode))
+    if bm is not None:  # Parsed while we were waiting to get here.
+        return bm
+
+    data = download_beatmap(ctx)
+    if data is None:
+        return None
+    # The file size is a rough proxy for the parsed beatmap's memory usage.
+    # Entries shared between two keys count twice, which errs on the safe side.
+    size = len(data)
+
+    rosu_mode = None if mode is None else consts.int2rosumode[mode]
+    raw = parsed_beatmaps.get((md5, None))
+    if raw is not None and raw.mode == rosu_mode:
+        parsed_beatmaps.put((md5, mode), raw, size=size)
+        return raw
+
+    bm = rosu.Beatmap(content=beatmap_text(data))
+    if rosu_mode is None or bm.mode == rosu_mode:
+        parsed_beatmaps.put((md5, None), bm, size=size)
+    else:
+        bm.convert(rosu_mode)
+    parsed_beatmaps.put((md5, mode), bm, size=size)
+
+    return bm
+
+
+def beatmap_page(ctx):
+    """Get everything we scrape from a beatmap's osu!web page."""
+    return scraped_page(ctx, "b", ctx.beatmap.beatmap_id, parse_beatmap_page)
+
+
+def player_page(ctx):
+    """Get everything we scrape from a player's osu!web profile."""
+    return scraped_page(ctx, "u", ctx.player.user_id, parse_player_page)
+
+
+def scraped_page(ctx, kind, id, parse):
+    """
+    Download and parse an osu!web page, at most once per context.
+    Returns a dict of the scraped values, or None if the download failed.
+    """
+    key = (kind, id)
+    if key not in ctx.pages:
+        text = request("%s/%s/%d" % (consts.old_url, kind, id))
+        ctx.pages[key] = parse(text) if text else None
+    return ctx.pages[key]
+
+
+def parse_beatmap_page(text):
+    """Extract the mapper ID and the top score's combo and misses."""
+    mapper = first_group(consts.mapper_id_re, text)
+    combo = first_group(consts.combo_re, text)
+    return {
+        "mapper_id": None if mapper is None else int(mapper),
+        "combo": None if combo is None else int(combo),
+        "misses": first_group(consts.misses_re, text),
+        "mania_misses": first_group(consts.mania_misses_re, text),
+    }
+
+
+def parse_player_page(text):
+    """Extract the old username and playstyle."""
+
+    mouse = "M" if consts.playstyle_m_re.search(text) else None
+    tablet = "TB" if consts.playstyle_tb_re.search(text) else None
+    touch = "TD" if consts.playstyle_td_re.search(text) else None
+    keyboard = "KB" if consts.playstyle_kb_re.search(text) else None
+
+    joined = "+".join(filter(bool, [mouse, tablet, touch, keyboard]))
 
-    return osu_path
+    return {
+        "old_username": first_group(consts.old_username_re, text),
+        "playstyle": None if not joined else joined,
+    }
+
+
+def first_group(regex, text):
+    """Get the first capture group of regex's first match in text, or None."""
+    match = regex.search(text)
+    return match.group(1) if match else None
 
 
 def mapper_id(ctx):
     """Get the mapper ID of a beatmap."""
-    text = request("%s/b/%d" % (consts.old_url, ctx.beatmap.beatmap_id))
-    if not text:
+    page = beatmap_page(ctx)
+    if not page:
         return None
 
-    match = consts.mapper_id_re.search(text)
-    if not match:
+    if page["mapper_id"] is None:
         ctx.logs.append("Mapper ID: No regex match")
-        return None
-    return int(match.group(1))
+    return page["mapper_id"]
 
 
 def player_old_username(ctx):
@@ -64,12 +202,8 @@ def player_old_username(ctx):
     if not ctx.player:
         return None
 
-    text = request("%s/u/%d" % (consts.old_url, ctx.player.user_id))
-    if not text:
-        return None
-
-    match = consts.old_username_re.search(text)
-    return match.group(1) if match else None
+    page = player_page(ctx)
+    return page["old_username"] if page else None
 
 
 def playstyle(ctx):
@@ -77,28 +211,25 @@ def playstyle(ctx):
     if not ctx.player:
         return None
 
-    website = request("%s/u/%d" % (consts.old_url, ctx.player.user_id))
-    if not website:
-        return None
-
-    mouse = "M" if consts.playstyle_m_re.search(website) else None
-    tablet = "TB" if consts.playstyle_tb_re.search(website) else None
-    touch = "TD" if consts.playstyle_td_re.search(website) else None
-    keyboard = "KB" if consts.playstyle_kb_re.search(website) else None
-
-    joined = "+".join(filter(bool, [mouse, tablet, touch, keyboard]))
-
-    return None if not joined else joined
+    page = player_page(ctx)
+    return page["playstyle"] if page else None
 
 
 def max_combo(ctx):
     """Try to find the max combo of a beatmap."""
-    if ctx.beatmap.max_combo is not None and ctx.beatmap.mode.value == ctx.mode:  # noqa
+    if ctx.beatmap.max_combo is not None and ctx.beatmap.mode == ctx.mode:
         return ctx.beatmap.max_combo
 
-    combo = api_max_combo(ctx)
+    md5 = ctx.beatmap.file_md5
+    combo = store.attributes.get(md5, consts.nomod, ctx.mode).get("max_combo")
     if combo is not None:
-        ctx.logs.append("Max combo: Found via API")
+        ctx.logs.append("Max combo: Found in attribute store")
+        return combo
+
+    combo = local_max_combo(ctx)
+    if combo is not None:
+        ctx.logs.append("Max combo: Computed from .osu file")
+        store.attributes.update(md5, consts.nomod, ctx.mode, max_combo=combo)
         return combo
 
     # Taiko is the only mode where the number of hitobject lines in
@@ -107,25 +238,39 @@ def max_combo(ctx):
         nobjs = map_objects(ctx)
         if nobjs is not None:
             ctx.logs.append("Max combo: Computed manually")
-            return nobjs[0] + nobjs[1]
+            combo = nobjs[0] + nobjs[1]
+            store.attributes.update(md5, consts.nomod, ctx.mode, max_combo=combo)
+            return combo
+
+    combo = api_max_combo(ctx)
+    if combo is not None:
+        ctx.logs.append("Max combo: Found via API")
+        store.attributes.update(md5, consts.nomod, ctx.mode, max_combo=combo)
+        return combo
 
     combo = web_max_combo(ctx)  # This might not be accurate for mania.
     if combo is not None:
         ctx.logs.append("Max combo: Found via osu!web")
+        if ctx.mode != consts.mania:
+            store.attributes.update(md5, consts.nomod, ctx.mode, max_combo=combo)
         return combo
     return None
 
 
+def local_max_combo(ctx):
+    """Compute the max combo from the .osu file, converted to ctx's mode."""
+    bm = safe_call(parse_beatmap, ctx, ctx.mode)
+    if bm is None:
+        return None
+    attrs = safe_call(rosu.Difficulty().calculate, bm)
+    return None if attrs is None else attrs.max_combo
+
+
 def api_max_combo(ctx):
     """Try to find the max combo from a score with the "perfect" bit set."""
-    scores = safe_call(
-        consts.osu_api.get_scores,
-        ctx.beatmap.beatmap_id,
-        mode=consts.int2osuapimode.get(ctx.mode),
-        limit=100,
-    )
-
-    for score in scores:
+    scores = leaderboards.top_scores(ctx.beatmap.beatmap_id, ctx.mode)
+
+    for score in scores or []:
         if score.perfect:
             return int(score.maxcombo)
 
@@ -135,47 +280,37 @@ def api_max_combo(ctx):
 def web_max_combo(ctx):
     """Try to find the max combo from the top rank on the leaderboard."""
     # TODO: We could look at all the scores on the leaderboard.
-    text = request("%s/b/%d" % (consts.old_url, ctx.beatmap.beatmap_id))
-    if not text:
+    page = beatmap_page(ctx)
+    if not page:
         return None
 
-    if ctx.mode == consts.mania:
-        misses_re = consts.mania_misses_re
-    else:
-        misses_re = consts.misses_re
-
-    match = consts.combo_re.search(text)
-    if not match:
+    if page["combo"] is None:
         ctx.logs.append("combo_re: No match")
         return None
-    combo = match.group(1)
-    match = misses_re.search(text)
-    if not match:
+    misses = page["mania_misses" if ctx.mode == consts.mania else "misses"]
+    if misses is None:
         ctx.logs.append("misses_re: No match")
         return None
 
-    return int(combo) if match.group(1) == "0" else None
+    return page["combo"] if misses == "0" else None
 
 
 def map_objects(ctx):
-    """Get the number of regular hitobjects and sliders in a map, or None."""
-    path = download_beatmap(ctx)
-    if path is None:
+    """
+    Get the number of regular hitobjects and sliders in a map, or None.
+    Beatmaps already in the store are memory-mapped instead of read whole.
+    """
+    if not ctx.beatmap:
         return None
-    with open(path) as f:
-        lines = f.read().split()
-
-    for i, line in enumerate(lines):
-        if "[HitObjects]" in line:
-            break
-    else:
+    path = store.beatmaps.stored_path(ctx.beatmap.file_md5)
+    counts = safe_call(osu_file.count_objects, path) if path else None
+    if counts is None:
+        data = download_beatmap(ctx)
+        if data is None:
+            return None
+        counts = osu_file.count_objects(data)
+    if not any(counts.values()):
         return None
-
-    regulars, sliders = 0, 0
-    for line in lines[(i + 1) :]:
-        if "|" in line:
-            sliders += 1
-        elif line:
-            regulars += 1
-
+    regulars = counts["circle"] + counts["spinner"] + counts["hold"]
+    sliders = counts["slider"]
     return regulars, sliders
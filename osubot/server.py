@@ -1,11 +1,14 @@
 import json
 import os
 import sys
+import threading
 import traceback
 
 import praw
+import requests
 
 from . import consts, scorepost
+from .jobs import JobQueue
 
 from flask import Flask, request
 from dotenv import load_dotenv
@@ -14,22 +17,55 @@ load_dotenv()
 
 app = Flask(__name__)
 
-testrun = False
 gameplay_flair = [os.environ.get("REDDIT_FLAIR_ID"), os.environ.get("REDDIT_FLAIR_NAME")]
+# PRAW isn't thread-safe, so each thread gets its own client,
+# but they all share one connection pool.
+reddit = threading.local()
+reddit_adapter = requests.adapters.HTTPAdapter(
+    pool_maxsize=consts.reddit_pool_size
+)
+queue = JobQueue(
+    consts.job_queue_path,
+    consts.job_attempts,
+    consts.job_backoff,
+    consts.job_lease,
+)
+
+
+def create_app():
+    """Start the job workers and get the app, for flask run."""
+    queue.start(process, consts.job_workers)
+    return app
 
 
 @app.route("/scorepost", methods=["POST"])
 def handler():
+    """Queue a score post to be processed in the background."""
     p_id = request.args.get("id")
     if p_id is None:
         return finish(status=400, error="Missing id parameter")
+    if queue.depth() >= consts.job_queue_limit:
+        return finish(status=503, error="Job queue is full")
+    print("Queueing post ID: %s" % p_id)
+    job = queue.enqueue(p_id, test=request.args.get("test") == "true")
+    return finish(status=202, job=job)
+
+
+@app.route("/scorepost/<p_id>", methods=["GET"])
+def job_status(p_id):
+    """Report the state of a score post's job."""
+    job = queue.get(p_id)
+    if job is None:
+        return finish(status=404, error="No job for post ID %s" % p_id)
+    return finish(job=job)
+
+
+def process(p_id, testrun=False):
+    """Comment on a score post. Returns a response body and status code."""
     print("Processing post ID: %s" % p_id)
-    global testrun
-    testrun = request.args.get("test") == "true"
-    reddit = reddit_login(consts.reddit_user)
-    post = praw.models.Submission(reddit, p_id)
+    post = praw.models.Submission(reddit_client(), p_id)
     try:
-        if post_is_saved(post):
+        if post_is_saved(post, testrun=testrun):
             return finish(error="Post is already saved")
     except Exception as e:  # Post likely doesn't exist.
         return finish(status=400, error=str(e))
@@ -45,13 +81,16 @@ def handler():
         return finish(status=500, error=str(e))
     if not reply:
         return finish(status=500, error="Reply is empty")
-    if post_has_reply(post, consts.reddit_user):
+    if post_has_reply(post, consts.reddit_user, testrun=testrun):
         return finish(error="Post already has a reply")
     ctx_d = ctx.to_dict()
-    err = post_reply(post, reply, sticky=True, flair=gameplay_flair)
+    posted, err = post_reply(
+        post, reply, sticky=True, flair=gameplay_flair, testrun=testrun
+    )
     if err:
+        # Once the comment is up, retrying would only post it again.
         return finish(
-            status=500,
+            status=200 if posted else 500,
             context=ctx_d,
             comment=reply,
             error=err,
@@ -61,24 +100,47 @@ def handler():
     return finish(context=ctx_d, comment=reply)
 
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Report this process's HTTP cache hit/miss counters."""
+    return {
+        "http_cache": consts.sess.cache_stats(),
+        "queue_depth": queue.depth(),
+    }
+
+
 def finish(status=200, error=None, **kwargs):
     if error:
         print(error)
     return {"error": error, **kwargs}, status
 
 
+def reddit_client():
+    """
+    Get this thread's Reddit client, logging in on first use.
+    PRAW refreshes the OAuth token by itself when it expires.
+    """
+    client = getattr(reddit, "client", None)
+    if client is None:
+        client = reddit.client = reddit_login(consts.reddit_user)
+    return client
+
+
 def reddit_login(username):
     """Log into Reddit."""
+    session = requests.Session()
+    session.mount("https://", reddit_adapter)
     return praw.Reddit(
         client_id=os.environ["REDDIT_CLIENT_ID"],
         client_secret=os.environ["REDDIT_CLIENT_SECRET"],
         password=os.environ["REDDIT_PASSWORD"],
         user_agent=username,
         username=username,
+        requestor_kwargs={"session": session},
     )
 
 
-def post_has_reply(post, username):
+def post_has_reply(post, username, testrun=False):
     """Check if post has a top-level reply by username."""
     return not testrun and any(
         c.author.name == username if c.author else False
@@ -86,15 +148,17 @@ def post_has_reply(post, username):
     )
 
 
-def post_reply(post, text, sticky=False, flair=[]):
+def post_reply(post, text, sticky=False, flair=[], testrun=False):
     """
     Reply to, save, and upvote a post, optionally flair it,
     and optionally sticky the comment.
-    Returns None on success, the error in string form otherwise.
+    Returns whether the comment was posted, and None on success or the
+    error in string form otherwise.
     """
     if testrun:
-        return None
+        return False, None
 
+    c = None
     try:
         c = post.reply(text)
         if sticky:
@@ -105,11 +169,11 @@ def post_reply(post, text, sticky=False, flair=[]):
             post.flair.select(*flair)
     except Exception as e:
         print("Reddit exception: %s" % e)
-        return str(e)
+        return c is not None, str(e)
 
-    return None
+    return True, None
 
 
-def post_is_saved(post):
+def post_is_saved(post, testrun=False):
     """Check whether the post is saved."""
     return not testrun and post.saved
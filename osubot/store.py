@@ -0,0 +1,277 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from . import consts
+from .utils import safe_call
+
+
+class AttributeStore:
+    """
+    A persistent store of difficulty attributes for beatmaps.
+    Entries are keyed by (file_md5, mods, mode) and hold a dict of values.
+    A mode of None means the beatmap as parsed, without any conversion.
+    When there are more than max_entries entries, the least recently used
+    ones are evicted. Entries stored under a different version (of the pp
+    calculator, for example) are dropped when the database is opened.
+    """
+
+    evict_interval = 100  # Writes between size checks.
+    touch_interval = 100  # Reads between usage time updates.
+
+    def __init__(self, path, max_entries, version=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version
+        self.writes = 0
+        self.touched = {}  # (md5, mods, mode) -> last read time, not yet saved.
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+        """Open the database, creating it if necessary."""
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS attributes (
+                    md5 TEXT, mods INTEGER, mode INTEGER, data TEXT, used REAL,
+                    PRIMARY KEY (md5, mods, mode)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS attributes_used ON attributes (used)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'version'"
+            ).fetchone()
+            if row is None or row[0] != str(self.version):
+                print("Attribute store version changed, clearing it")
+                conn.execute("DELETE FROM attributes")
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                    (str(self.version),),
+                )
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def get(self, md5, mods, mode):
+        """Get the stored values for a beatmap, or an empty dict."""
+        values = safe_call(self.select, md5, mods, -1 if mode is None else mode)
+        return values or {}
+
+    def update(self, md5, mods, mode, **values):
+        """Merge values into the stored values for a beatmap."""
+        safe_call(self.upsert, md5, mods, -1 if mode is None else mode, values)
+
+    def select(self, md5, mods, mode):
+        """
+        Read an entry and mark it as used.
+        Usage times are saved in batches, so that most reads don't write.
+        """
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute(
+                "SELECT data FROM attributes WHERE md5 = ? AND mods = ? AND mode = ?",
+                (md5, mods, mode),
+            ).fetchone()
+            if row is None:
+                return None
+            self.touched[(md5, mods, mode)] = time.time()
+            if len(self.touched) >= self.touch_interval:
+                self.touch(conn)
+                conn.commit()
+            return json.loads(row[0])
+
+    def touch(self, conn):
+        """Save the usage times of entries read since the last save."""
+        conn.executemany(
+            "UPDATE attributes SET used = ? WHERE md5 = ? AND mods = ? AND mode = ?",
+            [(used, *key) for key, used in self.touched.items()],
+        )
+        self.touched.clear()
+
+    def upsert(self, md5, mods, mode, values):
+        """Merge values into an entry, with nested dicts merged one level deep."""
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute(
+                "SELECT data FROM attributes WHERE md5 = ? AND mods = ? AND mode = ?",
+                (md5, mods, mode),
+            ).fetchone()
+            data = json.loads(row[0]) if row else {}
+            for k, v in values.items():
+                if isinstance(v, dict):
+                    data.setdefault(k, {}).update(v)
+                else:
+                    data[k] = v
+            conn.execute(
+                "INSERT OR REPLACE INTO attributes VALUES (?, ?, ?, ?, ?)",
+                (md5, mods, mode, json.dumps(data), time.time()),
+            )
+            self.touched.pop((md5, mods, mode), None)
+            if self.writes % self.evict_interval == 0:
+                self.touch(conn)
+                self.evict(conn)
+            self.writes += 1
+            conn.commit()
+
+    def evict(self, conn):
+        """Delete the least recently used entries beyond the size limit."""
+        (n,) = conn.execute("SELECT COUNT(*) FROM attributes").fetchone()
+        if n > self.max_entries:
+            conn.execute(
+                """
+                DELETE FROM attributes WHERE rowid IN (
+                    SELECT rowid FROM attributes ORDER BY used LIMIT ?
+                )
+                """,
+                (n - self.max_entries,),
+            )
+
+
+class BeatmapStore:
+    """
+    A local store of .osu files, addressed by their MD5 hash.
+    Files live at root/ab/cd/abcd...osu, gzipped if compress is set.
+    Each file is written to a temporary file and renamed into place, so
+    readers never see a partial file, and contents are checked against their
+    hash when read. When the files take up more than max_size bytes, the least
+    recently used ones are evicted.
+    """
+
+    evict_ratio = 0.9  # Evict down to this fraction of max_size.
+
+    def __init__(self, root, max_size, compress=False):
+        self.root = root
+        self.max_size = max_size
+        self.compress = compress
+        self.size = None  # Bytes on disk, counted on the first write.
+        self.lock = threading.Lock()
+
+    def path(self, md5):
+        """Get the path that a beatmap is stored at."""
+        ext = ".osu.gz" if self.compress else ".osu"
+        return os.path.join(self.root, md5[:2], md5[2:4], md5 + ext)
+
+    def get(self, md5):
+        """Get a beatmap's contents as bytes, or None."""
+        return safe_call(self.read, md5)
+
+    def stored_path(self, md5):
+        """
+        Get the path of a stored beatmap that can be read in place, or None.
+        Compressed beatmaps have to be read whole, so they have no such path.
+        """
+        if self.compress or not md5:
+            return None
+        path = self.path(md5)
+        if not os.path.isfile(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, md5, data):
+        """Store a beatmap's contents, if they match md5. Returns success."""
+        if hashlib.md5(data).hexdigest() != md5:
+            print("Beatmap contents don't match %s, not storing them" % md5)
+            return False
+        try:
+            self.write(md5, data)
+        except Exception as e:
+            print("Storing beatmap %s failed: %s" % (md5, e))
+            return False
+        return True
+
+    def read(self, md5):
+        """Read and verify a stored beatmap, and mark it as used."""
+        path = self.path(md5)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self.compress:
+            data = gzip.decompress(data)
+        if hashlib.md5(data).hexdigest() != md5:
+            print("Stored beatmap %s is corrupt, removing it" % md5)
+            os.remove(path)
+            return None
+        os.utime(path)
+        return data
+
+    def write(self, md5, data):
+        """Atomically write a beatmap, then evict old ones if necessary."""
+        path = self.path(md5)
+        body = gzip.compress(data) if self.compress else data
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.files())
+            else:
+                self.size += len(body) - old_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def files(self):
+        """List (mtime, size, path) for every stored beatmap."""
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:  # Evicted by another process.
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def evict(self):
+        """Delete the least recently used beatmaps beyond the size limit."""
+        files = sorted(self.files())
+        self.size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.size <= self.max_size * self.evict_ratio:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+attributes = AttributeStore(
+    consts.attr_store_path,
+    consts.attr_store_entries,
+    version=consts.attr_store_version,
+)
+beatmaps = BeatmapStore(
+    consts.beatmap_dir,
+    consts.beatmap_store_size,
+    compress=consts.beatmap_store_compress,
+)
@@ -1,10 +1,13 @@
-import pylev
+import io
 import os
 import sys
 import traceback
 import zipfile
 
 from . import consts
+from .cache import SingleFlight
+
+request_flights = SingleFlight()
 
 
 def map_str(beatmap):
@@ -119,7 +122,20 @@ def safe_call(f, *args, alt=None, msg=None, **kwargs):
 
 
 def request(url, *args, text=True, **kwargs):
-    """Wrapper around HTTP requests."""
+    """
+    Wrapper around HTTP requests.
+    Concurrent identical requests share one response.
+    """
+    key = (url, args, tuple(sorted(kwargs.items())), text)
+    try:
+        hash(key)
+    except TypeError:  # Unhashable arguments, like params={...}.
+        return fetch(url, *args, text=text, **kwargs)
+    return request_flights.do(key, fetch, url, *args, text=text, **kwargs)
+
+
+def fetch(url, *args, text=True, **kwargs):
+    """Make an HTTP request, and return the body or None on failure."""
     resp = safe_call(consts.sess.get, url, *args, **kwargs)
 
     if resp is None:
@@ -145,12 +161,56 @@ def safe_url(s):
     return s.replace(consts.osu_key, "###") # noqa
 
 
+def normalize(s):
+    """Normalize a string for lenient comparison."""
+    return s.replace(" ", "").replace("&quot;", '"').replace("&amp;", "&").upper()
+
+
 def compare(x, y):
     """Leniently compare two strings."""
-    x = x.replace(" ", "").replace("&quot;", '"').replace("&amp;", "&")
-    y = y.replace(" ", "").replace("&quot;", '"').replace("&amp;", "&")
+    return bounded_levenshtein(normalize(x), normalize(y), 2) <= 2
 
-    return pylev.levenshtein(x.upper(), y.upper()) <= 2
+
+def bounded_levenshtein(x, y, k):
+    """
+    Compute the edit distance between x and y, giving up once it exceeds k.
+    Returns k + 1 for any distance greater than k.
+    """
+    if x == y:
+        return 0
+    if len(x) > len(y):
+        x, y = y, x
+    n, m = len(x), len(y)
+    if m - n > k:
+        return k + 1
+
+    # Only cells within k of the diagonal can hold distances of k or less,
+    # so the rest of each row is skipped (Ukkonen's cutoff).
+    big = k + 1
+    prev = list(range(m + 1))
+    cur = [0] * (m + 1)
+    for i in range(1, n + 1):
+        lo = max(1, i - k)
+        hi = min(m, i + k)
+        cur[lo - 1] = i if lo == 1 else big
+        best = cur[lo - 1]
+        c = x[i - 1]
+        for j in range(lo, hi + 1):
+            d = prev[j - 1] + (c != y[j - 1])
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if cur[j - 1] + 1 < d:
+                d = cur[j - 1] + 1
+            cur[j] = d
+            if d < best:
+                best = d
+        if hi < m:
+            cur[hi + 1] = big  # The next row reads one cell past this band.
+        if best > k:
+            return big
+        prev, cur = cur, prev
+
+    return min(prev[m], big)
 
 
 def is_ignored(mods):
@@ -190,28 +250,25 @@ def matched_bracket_contents(s):
 
 
 def s3_zipped_download(key):
-    """Download and unzip a file from S3 to /tmp/."""
+    """Download a zip file from S3 and return its first file's contents."""
     if not os.environ.get("USE_S3_CACHE"):
-        return False
+        return None
 
-    zip_path = "/tmp/%s" % os.path.basename(key)
+    buf = io.BytesIO()
     try:
-        consts.s3_bucket.download_file(key, zip_path)
+        consts.s3_bucket.download_fileobj(key, buf)
+        with zipfile.ZipFile(buf) as zf:
+            return zf.read(zf.namelist()[0])
     except Exception as e:
         print("Downloading %s failed: %s" % (key, e))
-        return False
-
-    with zipfile.ZipFile(zip_path) as zf:
-        zf.extractall("/tmp/")
-
-    return True
+        return None
 
 
 def s3_zipped_upload(key, filename, body):
     """
     Zip and upload a file to S3.
     filename is the destination inside the archive, not the file to zip.
-    body is the string data to be zipped into filename.
+    body is the string or bytes data to be zipped into filename.
     """
     if not os.environ.get("USE_S3_CACHE"):
         return False
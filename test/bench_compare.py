@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""Compare utils.compare against a full pylev Levenshtein computation."""
+
+import pylev
+import random
+import string
+import timeit
+
+from osubot.utils import compare, normalize
+
+title = "Camellia - Exit This Earth's Atomosphere (Camellia's \"PLANETARY//200STEP\" Remix) [Evening Sky's Extreme Skyline Coverage]"  # noqa
+
+
+def old_compare(x, y):
+    return pylev.levenshtein(normalize(x), normalize(y)) <= 2
+
+
+def mutate(s, n):
+    """Apply n random single-character substitutions to s."""
+    s = list(s)
+    for i in random.sample(range(len(s)), n):
+        s[i] = random.choice(string.ascii_letters)
+    return "".join(s)
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    cases = [
+        ("identical", title),
+        ("2 edits", mutate(title, 2)),
+        ("10 edits", mutate(title, 10)),
+        ("unrelated", "xi - FREEDOM DiVE [FOUR DIMENSIONS]"),
+    ]
+    n = 200
+    for name, other in cases:
+        assert compare(title, other) == old_compare(title, other)
+        old = timeit.timeit(lambda: old_compare(title, other), number=n)
+        new = timeit.timeit(lambda: compare(title, other), number=n)
+        print(
+            "%-10s  pylev: %8.3fms  bounded: %8.3fms  (%.0fx)"
+            % (name, 1000 * old / n, 1000 * new / n, old / new)
+        )
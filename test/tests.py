@@ -1,7 +1,30 @@
+import contextlib
+import hashlib
+import importlib.util
 import logging
 import markdown_strings as md
+import os
 import osubot
+import osubot.jobs
+import osubot.leaderboards
+import osubot.mappers
+import osubot.osu_file
+import osubot.pp
+import osubot.records
+import osubot.server
 import re
+import rosu_pp_py as rosu
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import youtube_stub
+
+bin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, bin_dir)
+import checkpoint  # noqa
 
 logging.getLogger("urllib3").propagate = False
 
@@ -92,6 +115,56 @@ def isapprox(x, y, t=0.005):
     return abs(x - y) < t
 
 
+@contextlib.contextmanager
+def patched(obj, **attrs):
+    """Replace attributes of obj for the duration of a with block."""
+    old = {k: getattr(obj, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(obj, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(obj, k, v)
+
+
+@contextlib.contextmanager
+def cleared(*caches):
+    """Clear caches at the end of a with block."""
+    try:
+        yield
+    finally:
+        for cache in caches:
+            cache.clear()
+
+
+@contextlib.contextmanager
+def local_beatmap(data):
+    """Serve data as every .osu file, with an empty attribute store."""
+    with tempfile.TemporaryDirectory() as d:
+        attributes = osubot.store.AttributeStore(os.path.join(d, "a.sqlite"), 10)
+        download = patched(osubot.scrape, download_beatmap=lambda ctx: data)
+        store = patched(osubot.store, attributes=attributes)
+        with download, store, cleared(osubot.scrape.parsed_beatmaps):
+            yield
+
+
+def load_script(name):
+    """Import a fresh copy of one of the scripts in bin."""
+    path = os.path.join(bin_dir, "%s.py" % name)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reddit_thing(fullname):
+    """A fake Reddit post or comment."""
+    return types.SimpleNamespace(
+        id=fullname.split("_")[-1], fullname=fullname, created_utc=0
+    )
+
+
 def test_combine_mods():
     assert osubot.utils.combine_mods(1 >> 1) == ""
     assert osubot.utils.combine_mods(1 << 3 | 1 << 9 | 1 << 6) == "+HDNC"
@@ -221,6 +294,52 @@ def test_compare():
     assert osubot.utils.compare("foo", "fob")
 
 
+def test_search_index():
+    def beatmap(b_id, version):
+        return osubot.records.Beatmap(
+            beatmap_id=b_id, artist="Camellia", title="Ghost", version=version
+        )
+
+    maps = {1: beatmap(1, "Extra"), 2: beatmap(2, "Extra"), 3: beatmap(3, "Hard")}
+    found = []
+
+    def search_player(player, beatmap, logs=[]):
+        return found[0] if found else None
+
+    search = osubot.beatmap_search
+    with patched(
+        search,
+        index=osubot.beatmap_index.BeatmapIndex(10),
+        search_player=search_player,
+        get_beatmap=maps.get,
+    ):
+        search.index.add(maps[3])
+        # Only the ID comes from the index, so updates to the map show up.
+        maps[3] = beatmap(3, "Hard")
+        maps[3].approved = 1
+        assert search.search(None, "Camellia - Ghost [Hard]") is maps[3]
+        search.index.add(maps[1])
+        search.index.add(maps[2])
+        # Two maps share the name, so the player has to decide.
+        assert search.search(None, "Camellia - Ghost [Extra]") is None
+        found.append(maps[2])
+        assert search.search(None, "Camellia - Ghost [Extra]") is maps[2]
+        # A near match isn't trusted either.
+        found[0] = maps[1]
+        assert search.search(None, "Camellia - Ghost [Extra+]") is maps[1]
+
+
+def test_bounded_levenshtein():
+    func = osubot.utils.bounded_levenshtein
+    assert func("", "", 2) == 0
+    assert func("foo", "foo", 0) == 0
+    assert func("kitten", "sitting", 3) == 3
+    assert func("kitten", "sitting", 2) == 3
+    assert func("foo", "foobarbaz", 2) == 3
+    assert func("abcdef", "badcfe", 10) == 4
+    assert func("abcdef", "badcfe", 1) == 2
+
+
 def test_safe_url():
     assert osubot.utils.safe_url("") == ""
     assert osubot.utils.safe_url("foobar") == "foobar"
@@ -261,6 +380,710 @@ def test_matched_bracket_contents():
     assert func("[foo bar [ baz]") is None
 
 
+def test_context_evolve():
+    ctx = osubot.context.Context("p", "b", 0, 0, 99.5, None, ["log"])
+    clone = ctx.evolve(mods=8, logs=[])
+    assert (clone.player, clone.beatmap, clone.mods, clone.acc) == ("p", "b", 8, 99.5)  # noqa
+    assert clone.pages is ctx.pages
+    clone.logs.append("hover")
+    assert ctx.logs == ["log"] and ctx.mods == 0
+    try:
+        ctx.mods = 8
+        assert False
+    except AttributeError:
+        pass
+
+
+def test_records():
+    model = types.SimpleNamespace(
+        **{k: k for k in osubot.records.Beatmap.__slots__},
+    )
+    model.mode = types.SimpleNamespace(value=osubot.consts.taiko)
+    model.approved = types.SimpleNamespace(value=1)
+    beatmap = osubot.records.Beatmap.from_api(model)
+    assert beatmap.mode == osubot.consts.taiko and beatmap.approved == 1
+    assert beatmap.artist == "artist" and not hasattr(beatmap, "__dict__")
+    event = types.SimpleNamespace(beatmap_id=1, display_html="x", date=None)
+    model = types.SimpleNamespace(user_id=2, username="foo", events=[event])
+    player = osubot.records.Player.from_api(model)
+    assert str(player) == "foo" and player.pp_raw is None
+    assert player.events == (osubot.records.Event(beatmap_id=1, display_html="x"),)  # noqa
+    assert osubot.records.first([], osubot.records.Player) is None
+
+
+def test_render_parallel():
+    def fast(ctx):
+        return "fast"
+
+    def slow(ctx):
+        time.sleep(0.5)
+        return "slow"
+
+    def last(ctx):
+        return "last"
+
+    with patched(osubot.consts, section_timeout=0.2):
+        ctx = types.SimpleNamespace(logs=[])
+        rendered = osubot.markdown.render_parallel(ctx, [fast, slow, last])
+        assert rendered == ["fast", None, "last"]
+        assert ctx.logs == ["slow: Timed out"]
+
+
+def test_mode_lookups():
+    calls = []
+
+    class Api:
+        def get_user(self, user, mode):
+            calls.append(("get_user", user, mode))
+            return [types.SimpleNamespace(user_id=2, username="foo", events=[])]
+
+        def get_beatmaps(self, beatmap_id, mode, include_converted):
+            calls.append(("get_beatmaps", beatmap_id, mode))
+            value = types.SimpleNamespace(value=osubot.consts.taiko)
+            return [types.SimpleNamespace(beatmap_id=1, mode=value, approved=value)]
+
+    with patched(osubot.consts, osu_api=Api()):
+        taiko = osubot.consts.taiko
+        apimode = osubot.consts.int2osuapimode[taiko]
+        player = osubot.context.getplayer_mode(taiko_t, taiko)
+        assert player.user_id == 2
+        assert calls == [("get_user", "APPLERSS", apimode)]
+        assert osubot.context.getplayer_mode("no player", taiko, player="p") == "p"
+        std = osubot.records.Beatmap(beatmap_id=1, mode=osubot.consts.std)
+        assert osubot.context.getmap_mode(std, taiko).mode == taiko
+        assert calls[-1] == ("get_beatmaps", 1, apimode)
+        mania = osubot.records.Beatmap(beatmap_id=1, mode=osubot.consts.mania)
+        assert osubot.context.getmap_mode(mania, taiko) is mania
+        assert len(calls) == 2
+
+
+def test_search_ids():
+    def beatmap(b_id, title):
+        return osubot.records.Beatmap(
+            beatmap_id=b_id, artist="Artist", title=title, version="Hard"
+        )
+
+    maps = {1: beatmap(1, "Other"), 2: beatmap(2, "Song"), 3: beatmap(3, "Song")}
+    calls = []
+
+    def get_beatmap(b_id):
+        calls.append(b_id)
+        return maps[b_id]
+
+    search = osubot.beatmap_search
+    patch = patched(search, get_beatmap=get_beatmap)
+    with patch, cleared(search.beatmap_cache):
+        search.beatmap_cache.put(3, maps[3])
+        assert search.search_ids([1, 2, 3], "Artist - Song [Hard]") is maps[3]
+        assert calls == []  # Cached beatmaps are checked first.
+        search.beatmap_cache.clear()
+        assert search.search_ids([1, 1, 2, 3], "Artist - Song [Hard]") is maps[2]
+        assert calls.count(1) == 1 and 2 in calls
+        assert search.search_ids([1], "Artist - Song [Hard]") is None
+
+
+def test_lru_cache():
+    cache = osubot.cache.LRUCache(3)
+    cache.put("a", 1)
+    cache.put("b", 2, size=2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # Evicts b, since a was used more recently.
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    cache.put("d", 4, size=10)  # Too big to ever fit.
+    assert cache.get("d") is None
+    assert cache.pop("a") == 1
+    assert len(cache) == 1 and cache.size == 1
+
+    cache = osubot.cache.LRUCache(3, ttl=0.01)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.02)
+    assert "a" not in cache and cache.size == 0
+
+
+def test_parse_beatmap_once():
+    text = b"""osu file format v14
+
+[HitObjects]
+256,192,1000,1,0,0:0:0:0:
+"""
+    parsed = []
+    started, release = threading.Event(), threading.Event()
+
+    def download_beatmap(ctx):
+        started.set()
+        release.wait(5)
+        return text
+
+    def parse(content):
+        parsed.append(content)
+        time.sleep(0.05)  # Give the other calls time to race this one.
+        return rosu.Beatmap(content=content)
+
+    scrape = osubot.scrape
+    patch = patched(
+        scrape,
+        download_beatmap=download_beatmap,
+        rosu=types.SimpleNamespace(Beatmap=parse),
+    )
+    with patch, cleared(scrape.parsed_beatmaps):
+        beatmap = types.SimpleNamespace(beatmap_id=1, file_md5="once")
+        ctx = types.SimpleNamespace(beatmap=beatmap, logs=[])
+        pool = osubot.consts.lookup_pool
+        first = pool.submit(scrape.parse_beatmap, ctx, osubot.consts.std)
+        started.wait(5)
+        rest = [
+            pool.submit(scrape.parse_beatmap, ctx, osubot.consts.std)
+            for _ in range(3)
+        ]
+        time.sleep(0.05)
+        release.set()
+        bm = first.result()
+        assert all(f.result() is bm for f in rest)
+        assert scrape.parse_beatmap(ctx) is bm  # Already in its own mode.
+        assert len(parsed) == 1
+        scrape.parse_beatmap(ctx, osubot.consts.taiko)
+        assert len(parsed) == 2
+
+
+def test_single_flight():
+    flights = osubot.cache.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def f(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x * 2
+
+    pool = osubot.consts.lookup_pool
+    first = pool.submit(flights.do, "k", f, 1)
+    started.wait(5)
+    rest = [pool.submit(flights.do, "k", f, 1) for _ in range(3)]
+    time.sleep(0.05)
+    release.set()
+    assert [fut.result() for fut in [first] + rest] == [2] * 4
+    assert calls == [1]
+    assert flights.do("k", f, 2) == 4 and calls == [1, 2]
+    try:
+        flights.do("k", int, "x")
+        assert False
+    except ValueError:
+        pass
+    assert flights.calls == {}
+
+    def fetch(url, *args, text=True, **kwargs):
+        return url, kwargs
+
+    with patched(osubot.utils, fetch=fetch):
+        params = {"k": "v"}
+        assert osubot.utils.request("u", params=params) == ("u", {"params": params})
+        assert osubot.utils.request("u", timeout=1) == ("u", {"timeout": 1})
+
+
+def test_counting_session():
+    server = youtube_stub.start()
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "http.sqlite")
+        sess = osubot.cache.CountingSession(
+            path,
+            backend="sqlite",
+            ignored_parameters=["k"],
+            max_size=0,
+            prune_interval=3,
+        )
+        try:
+            url = server.url + "?id=a&k=secret"
+            assert not sess.get(url).from_cache
+            assert sess.get(url).from_cache
+            assert len(server.requests) == 1
+            with open(path, "rb") as f:
+                assert b"secret" not in f.read()
+            stats = sess.cache_stats()[osubot.cache.endpoint(url)]
+            assert stats == {"hits": 1, "misses": 1}
+            sess.get(server.url + "?id=b")  # Prunes everything.
+            assert sess.cache.responses.count() == 0
+        finally:
+            sess.close()
+            server.shutdown()
+
+
+def test_http_ttls():
+    from requests_cache import DO_NOT_CACHE
+    from requests_cache.policy.expiration import get_url_expiration
+
+    def ttl(url):
+        return get_url_expiration(url, osubot.consts.http_ttls)
+
+    api = "https://osu.ppy.sh/api/get_beatmaps?k=key&"
+    assert ttl(api + "u=2&type=id") < ttl(api + "b=1") == ttl(api + "h=abc")
+    assert ttl(api + "since=2020-01-01&u=2") == ttl(api + "u=2&type=id")
+    assert ttl("https://old.ppy.sh/osu/1") == DO_NOT_CACHE
+    assert ttl("https://api.tillerino.org/beatmaps/byHash/abc?k=1") == DO_NOT_CACHE
+
+
+def test_mapper_profile():
+    calls = []
+
+    def beatmap(set_id, approved):
+        approved = types.SimpleNamespace(value=approved)
+        return types.SimpleNamespace(beatmapset_id=set_id, approved=approved)
+
+    class Api:
+        def get_user(self, mapper):
+            calls.append(("get_user", mapper))
+            return [types.SimpleNamespace(user_id=2, username="Mapper")]
+
+        def get_beatmaps(self, username):
+            calls.append(("get_beatmaps", username))
+            return [beatmap(1, 1), beatmap(1, 1), beatmap(2, 4), beatmap(3, -2)]
+
+    patch = patched(osubot.consts, osu_api=Api())
+    with patch, cleared(osubot.mappers.profiles):
+        profile = osubot.mappers.profile("mapper")
+        assert profile["user_id"] == 2 and profile["username"] == "Mapper"
+        assert profile["sets"] == 3
+        assert profile["counts"] == {
+            "Ranked": 1,
+            "Qualified": 0,
+            "Loved": 1,
+            "Unranked": 1,
+        }
+        assert osubot.mappers.profile(2) is profile
+        assert osubot.mappers.profile("MAPPER") is profile
+        assert calls == [("get_user", "mapper"), ("get_beatmaps", 2)]
+
+
+def test_leaderboard_cache():
+    calls = []
+
+    class Api:
+        def get_scores(self, beatmap_id, mode, limit):
+            calls.append((beatmap_id, mode, limit))
+            return [types.SimpleNamespace(perfect=False, maxcombo=10)] * 2 + [
+                types.SimpleNamespace(perfect=True, maxcombo=12)
+            ]
+
+    patch = patched(osubot.consts, osu_api=Api())
+    with patch, cleared(osubot.leaderboards.leaderboards):
+        beatmap = types.SimpleNamespace(beatmap_id=1)
+        ctx = types.SimpleNamespace(beatmap=beatmap, mode=None, logs=[])
+        assert osubot.scrape.api_max_combo(ctx) == 12
+        assert len(osubot.leaderboards.top_scores(1, osubot.consts.std)) == 3
+        std = osubot.consts.int2osuapimode[osubot.consts.std]
+        assert calls == [(1, std, 100)]
+
+
+def test_local_max_combo():
+    text = """osu file format v14
+
+[Difficulty]
+SliderMultiplier:1.4
+SliderTickRate:1
+
+[TimingPoints]
+0,500,4,2,0,100,1,0
+
+[HitObjects]
+256,192,1000,1,0,0:0:0:0:
+256,192,2000,1,0,0:0:0:0:
+256,192,3000,2,0,L|356:192,1,100
+"""
+    with local_beatmap(text.encode()):
+        beatmap = types.SimpleNamespace(
+            beatmap_id=1, file_md5="combo", max_combo=None, mode=osubot.consts.std
+        )
+        ctx = types.SimpleNamespace(beatmap=beatmap, mode=osubot.consts.std, logs=[])
+        assert osubot.scrape.max_combo(ctx) == 4  # Two circles and a slider.
+        assert ctx.logs == ["Max combo: Computed from .osu file"]
+
+
+def test_pp_ladder():
+    text = b"""osu file format v14
+
+[Difficulty]
+OverallDifficulty:8
+ApproachRate:9
+
+[TimingPoints]
+0,500,4,2,0,100,1,0
+
+[HitObjects]
+256,192,1000,1,0,0:0:0:0:
+128,192,1500,1,0,0:0:0:0:
+256,192,2000,1,0,0:0:0:0:
+"""
+    with local_beatmap(text):
+        beatmap = types.SimpleNamespace(beatmap_id=1, file_md5="ladder")
+        accs, mods = [95, 99.5, 100], [osubot.consts.nomod, 24]
+        for mode in osubot.consts.int2rosumode:
+            ctx = types.SimpleNamespace(beatmap=beatmap, mode=mode, mods=24, logs=[])
+            ladder = osubot.pp.pp_ladder(ctx, accs, mods)
+            bm = rosu.Beatmap(content=text.decode())
+            bm.convert(osubot.consts.int2rosumode[mode])
+            for i, acc in enumerate(accs):
+                for j, m in enumerate(mods):
+                    perf = rosu.Performance(mods=m, accuracy=acc)
+                    assert isapprox(ladder[i][j], perf.calculate(bm).pp)
+            if mode != osubot.consts.mania:  # HDHR doesn't change mania pp.
+                assert ladder[2][0] < ladder[2][1]
+        with patched(osubot.scrape, download_beatmap=lambda ctx: None):
+            assert osubot.pp.pp_ladder(ctx, accs, mods) == ladder  # Stored.
+
+
+def test_attribute_store():
+    with tempfile.TemporaryDirectory() as d:
+        store = osubot.store.AttributeStore(os.path.join(d, "a.sqlite"), 2)
+        store.evict_interval = 1
+        store.update("a", 0, None, sr=1.5, pp={"95.00": 100})
+        store.update("a", 0, None, pp={"98.00": 120})
+        assert store.get("a", 0, None) == {"sr": 1.5, "pp": {"95.00": 100, "98.00": 120}}  # noqa
+        assert store.get("a", 0, osubot.consts.std) == {}
+        store.update("b", 0, None, sr=2)
+        time.sleep(0.01)
+        store.get("a", 0, None)
+        store.update("c", 0, None, sr=3)  # Evicts b, the least recently used.
+        store.update("d", 0, None, sr=4)
+        assert store.get("b", 0, None) == {}
+        assert store.get("d", 0, None) == {"sr": 4}
+
+        path = os.path.join(d, "v.sqlite")
+        store = osubot.store.AttributeStore(path, 10, version="1")
+        store.update("a", 0, None, sr=1.5)
+        store.get("a", 0, None)
+        assert store.touched  # Reads don't write straight away.
+        store = osubot.store.AttributeStore(path, 10, version="1")
+        assert store.get("a", 0, None) == {"sr": 1.5}
+        store = osubot.store.AttributeStore(path, 10, version="2")
+        assert store.get("a", 0, None) == {}
+
+
+def test_beatmap_store():
+    a, b, c = b"a" * 100, b"b" * 100, b"c" * 100
+    md5 = {x: hashlib.md5(x).hexdigest() for x in [a, b, c]}
+    with tempfile.TemporaryDirectory() as d:
+        store = osubot.store.BeatmapStore(d, 250)
+        assert store.get(md5[a]) is None
+        assert not store.put(md5[a], b)
+        assert store.put(md5[a], a) and store.get(md5[a]) == a
+        assert store.put(md5[b], b)
+        os.utime(store.path(md5[a]), (0, 0))  # a is the least recently used.
+        assert store.put(md5[c], c)
+        assert store.get(md5[a]) is None
+        assert store.get(md5[b]) == b and store.get(md5[c]) == c
+        assert store.put(md5[c], c) and store.size == 200  # Overwritten.
+        assert store.stored_path(md5[c]) == store.path(md5[c])
+        assert store.stored_path(md5[a]) is None
+        with open(store.path(md5[b]), "wb") as f:
+            f.write(b"corrupt")
+        assert store.get(md5[b]) is None
+        assert not os.path.exists(store.path(md5[b]))
+    with tempfile.TemporaryDirectory() as d:
+        store = osubot.store.BeatmapStore(d, 250, compress=True)
+        assert store.put(md5[a], a) and store.get(md5[a]) == a
+        assert os.path.getsize(store.path(md5[a])) < len(a)
+        assert store.stored_path(md5[a]) is None
+
+
+def test_missing_beatmap():
+    urls = []
+
+    def request(url, *args, **kwargs):
+        urls.append(url)
+        return None
+
+    with tempfile.TemporaryDirectory() as d:
+        store = patched(osubot.store, beatmaps=osubot.store.BeatmapStore(d, 1000))
+        fetch = patched(osubot.scrape, request=request)
+        with store, fetch, cleared(osubot.scrape.missing_beatmaps):
+            beatmap = types.SimpleNamespace(beatmap_id=1, file_md5="missing")
+            ctx = types.SimpleNamespace(beatmap=beatmap, logs=[])
+            assert osubot.scrape.download_beatmap(ctx) is None
+            assert len(urls) == 2
+            assert osubot.scrape.download_beatmap(ctx) is None
+            assert osubot.scrape.map_objects(ctx) is None
+            assert len(urls) == 2
+            assert ctx.logs == [".osu: Not downloaded"]
+
+
+def test_beatmap_index():
+    class Foo:
+        def __init__(self, b_id, a, t, v):
+            self.beatmap_id = b_id
+            self.artist = a
+            self.title = t
+            self.version = v
+
+    index = osubot.beatmap_index.BeatmapIndex(2)
+    index.add(Foo(1, "xi", "FREEDOM DiVE", "FOUR DIMENSIONS"))
+    index.add(Foo(2, "xi", "FREEDOM DiVE", "Another"))
+    matches = index.lookup("xi - freedom dive [FOUR DIMENSION]")
+    assert matches == [(1, 1)]
+    assert not index.lookup("xi - Blue Zenith [FOUR DIMENSIONS]")
+    index.add(Foo(3, "a", "b", "c"))  # Evicts 2, the least recently used.
+    assert len(index) == 2
+    assert not index.lookup("xi - FREEDOM DiVE [Another]")
+    assert index.lookup("a-b[c]")[0][1] == 3
+
+
+def test_parse_pages():
+    text = """<td>Creator:</td><td class="colour"><a href="/u/2">peppy</a>
+<strong>Max Combo</strong></td><td>1234</td>
+<strong>Misses</strong></td><td>0</td>"""
+    page = osubot.scrape.parse_beatmap_page(text)
+    assert page == {
+        "mapper_id": 2,
+        "combo": 1234,
+        "misses": "0",
+        "mania_misses": None,
+    }
+    text = """<div class="profile-username" title="Previously known as foo">
+<div class="playstyle mouse using"></div><div class="playstyle keyboard using"></div>"""  # noqa
+    page = osubot.scrape.parse_player_page(text)
+    assert page == {"old_username": "foo", "playstyle": "M+KB"}
+
+
+def test_osu_file():
+    text = """osu file format v14
+
+[Metadata]
+Title:[HitObjects] in a title
+
+[Difficulty]
+CircleSize: 4
+OverallDifficulty:8
+
+[HitObjects]
+// A comment.
+256,192,1000,1,0,0:0:0:0:
+256,192,2000,2,0,B|300:200|350:180,1,100
+256,192,3000,12,0,4000,0:0:0:0:
+64,192,5000,128,0,5500:0:0:0:0:
+"""
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "map.osu")
+        with open(path, "w") as f:
+            f.write(text)
+        assert osubot.osu_file.count_objects(path) == {
+            "circle": 1,
+            "slider": 1,
+            "spinner": 1,
+            "hold": 1,
+        }
+        values = osubot.osu_file.section_values(path, "Difficulty")
+        assert values == {"CircleSize": "4", "OverallDifficulty": "8"}
+        assert list(osubot.osu_file.section_lines(path, "Events")) == []
+        counts = osubot.osu_file.count_objects(text.encode())
+        assert counts == osubot.osu_file.count_objects(path)
+        open(path, "w").close()
+        assert list(osubot.osu_file.section_lines(path, "HitObjects")) == []
+
+
+def test_job_queue():
+    with tempfile.TemporaryDirectory() as d:
+        queue = osubot.jobs.JobQueue(os.path.join(d, "j.sqlite"), 2, backoff=0)
+        assert queue.enqueue("a")["state"] == "queued"
+        assert queue.enqueue("a")["attempts"] == 0
+        assert queue.depth() == 1
+        job = queue.claim()
+        assert job["id"] == "a" and job["attempts"] == 1
+        assert queue.claim() is None
+        queue.finish(job, {"error": "x"}, 500, retry=True)
+        assert queue.get("a")["state"] == "queued"
+        queue.finish(queue.claim(), {"error": "x"}, 500, retry=True)
+        assert queue.get("a")["state"] == "failed"
+        assert queue.enqueue("a")["state"] == "queued"
+        queue.finish(queue.claim(), {"error": None}, 200)
+        job = queue.get("a")
+        assert job["state"] == "done" and job["result"] == {"error": None}
+        assert queue.enqueue("a")["state"] == "done"
+
+        queue.lease = 60
+        queue.enqueue("b")
+        job = queue.claim()
+        queue.recover()  # Still within its lease, so it's left alone.
+        assert queue.get("b")["state"] == "running"
+        queue.lease = -1
+        queue.recover()
+        assert queue.get("b")["state"] == "queued"
+
+        # A real job replaces a test job, even one that's still running.
+        queue.finish(queue.claim(), {"error": None}, 200)
+        assert queue.enqueue("c", test=True)["test"]
+        job = queue.claim()
+        assert not queue.enqueue("c")["test"]
+        queue.finish(job, {"error": None}, 200)  # The test run is ignored.
+        assert queue.get("c")["state"] == "queued"
+        queue.finish(queue.claim(), {"error": None}, 200)
+        assert queue.enqueue("c", test=True)["state"] == "done"
+        assert not queue.get("c")["test"]
+
+
+def test_post_reply():
+    def fail(*args):
+        raise Exception("Reddit is down")
+
+    comment = types.SimpleNamespace(
+        mod=types.SimpleNamespace(distinguish=lambda sticky: None)
+    )
+    post = types.SimpleNamespace(
+        reply=lambda text: comment,
+        save=lambda: None,
+        upvote=lambda: None,
+        flair=types.SimpleNamespace(select=fail),
+    )
+    reply = osubot.server.post_reply
+    assert reply(post, "x", sticky=True, flair=["a"]) == (True, "Reddit is down")
+    assert reply(post, "x", sticky=True) == (True, None)
+    assert reply(post, "x", testrun=True) == (False, None)
+    post.reply = fail
+    assert reply(post, "x") == (False, "Reddit is down")
+
+
+def test_youtube_batch():
+    video_links = load_script("video_links")
+
+    server = youtube_stub.start()
+    try:
+        video_links.yt_api = server.url
+        data = video_links.get_youtube_data_batch(["a", "b", "a", "missing"])
+        assert data == {"a": ("Title a", "Channel"), "b": ("Title b", "Channel")}
+        assert len(server.requests) == 1
+        assert video_links.get_youtube_data("b") == ("Title b", "Channel")
+        assert len(server.requests) == 1  # Cached.
+        assert video_links.get_youtube_data("missing2") == (None, None)
+        assert len(server.requests) == 2
+    finally:
+        server.shutdown()
+
+
+def test_video_links_pending():
+    video_links = load_script("video_links")
+    now = [100]
+    processed = []
+
+    def process_comment(comment, delayed=False):
+        if comment.id == "bad":
+            raise Exception("Reddit is down")
+        processed.append((comment.id, delayed))
+
+    def comment(c_id):
+        return types.SimpleNamespace(
+            id=c_id,
+            is_root=True,
+            saved=False,
+            body="https://youtu.be/abc",
+            created_utc=now[0],
+            submission=types.SimpleNamespace(created_utc=now[0] - 10),
+        )
+
+    video_links.time = types.SimpleNamespace(time=lambda: now[0])
+    video_links.reddit = types.SimpleNamespace(
+        info=lambda fullnames: [comment(f[3:]) for f in fullnames]
+    )
+    video_links.prefetch_youtube_data = lambda comments: None
+    with tempfile.TemporaryDirectory() as d:
+        video_links.pending_path = os.path.join(d, "pending.json")
+        # Made right after the post, so it's parked.
+        video_links.process_comment(comment("a"))
+        video_links.process_comment = process_comment
+        video_links.schedule("bad", 60)
+        assert [p[1] for p in video_links.pending] == ["a", "bad"]
+
+        video_links.pending = []
+        video_links.load_pending()  # As if restarted.
+        assert video_links.pending == [(130, "a", 0), (160, "bad", 0)]
+
+        now[0] = 129
+        video_links.process_pending()
+        assert processed == [] and len(video_links.pending) == 2
+        now[0] = 130
+        video_links.process_pending()
+        assert processed == [("a", True)]
+        now[0] = 160
+        video_links.process_pending()  # Fails, so it's parked again.
+        assert video_links.pending == [(190, "bad", 1)]
+        video_links.pending = []
+        video_links.load_pending()
+        assert video_links.pending == [(190, "bad", 1)]
+
+
+def test_checkpoint():
+    thing = reddit_thing
+    with tempfile.TemporaryDirectory() as d:
+        checkpoint.data_dir = d
+        cp = checkpoint.Checkpoint("foo")
+        assert not cp.seen(thing("t1_a"))
+        assert cp.catch_up([thing("t1_b")]) == []
+        cp.advance(thing("t1_b"))
+        cp.advance(thing("t1_a"))  # Older, so ignored.
+        assert cp.seen(thing("t1_a")) and cp.seen(thing("t1_b"))
+        assert not cp.seen(thing("t1_10"))
+
+        cp = checkpoint.Checkpoint("foo")  # Reloaded from disk.
+        assert cp.fullname == "t1_b"
+        listing = [thing("t1_z"), thing("t1_c"), thing("t1_b"), thing("t1_a")]
+        assert [t.fullname for t in cp.catch_up(listing)] == ["t1_c", "t1_z"]
+
+        cp = checkpoint.Checkpoint("foo", persist=False)
+        cp.advance(thing("t1_z"))
+        assert cp.seen(thing("t1_z"))
+        assert checkpoint.Checkpoint("foo").fullname == "t1_b"
+
+
+def test_monitor_dispatch():
+    monitor = load_script("monitor")
+    statuses = {"a": [503, 202], "b": [None, 202]}
+    calls, sleeps = [], []
+    release = threading.Event()
+
+    def post_api(p_id):
+        calls.append(p_id)
+        release.wait(5)
+        status = statuses[p_id].pop(0)
+        if status is None:
+            raise Exception("Connection refused")
+        return status
+
+    monitor.post_api = post_api
+    monitor.time = types.SimpleNamespace(time=time.time, sleep=sleeps.append)
+    with tempfile.TemporaryDirectory() as d:
+        checkpoint.data_dir = d
+        monitor.checkpoint = checkpoint.Checkpoint("submissions")
+        a, b = reddit_thing("t3_a"), reddit_thing("t3_b")
+        monitor.dispatch(a)
+        monitor.dispatch(a)  # Already in flight, so skipped.
+        monitor.dispatch(b)
+        assert set(monitor.in_flight) == {"a", "b"}
+        release.set()
+        monitor.pool.shutdown(wait=True)
+        # Each post was retried once after a 503 or an exception.
+        assert sorted(calls) == ["a", "a", "b", "b"]
+        assert sleeps == [2, 2]
+        assert not monitor.in_flight and not monitor.failed
+        # b can finish first, while a still holds the checkpoint back.
+        assert monitor.checkpoint.fullname in ["t3_a", "t3_b"]
+
+
+def test_monitor_give_up():
+    monitor = load_script("monitor")
+    statuses = {"a": 503, "b": 202}
+    monitor.post_api = lambda p_id: statuses[p_id]
+    monitor.time = types.SimpleNamespace(time=time.time, sleep=lambda s: None)
+    with tempfile.TemporaryDirectory() as d:
+        checkpoint.data_dir = d
+        monitor.checkpoint = checkpoint.Checkpoint("submissions")
+        a, b = reddit_thing("t3_a"), reddit_thing("t3_b")
+        monitor.dispatch(a)
+        monitor.dispatch(b)
+        monitor.pool.shutdown(wait=True)
+        # b succeeded, but a was given up on, so it holds the checkpoint back.
+        assert list(monitor.failed) == ["a"] and not monitor.in_flight
+        assert monitor.checkpoint.fullname is None
+
+
 def test_strip_annots():
     assert osubot.context.strip_annots("") == ""
     assert osubot.context.strip_annots("foo") == "FOO"
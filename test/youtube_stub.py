@@ -0,0 +1,40 @@
+"""A local stand-in for the YouTube Data API's videos endpoint."""
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        query = parse_qs(urlparse(self.path).query)
+        ids = query.get("id", [""])[0].split(",")
+        items = [
+            {
+                "id": yt_id,
+                "snippet": {"title": "Title %s" % yt_id, "channelTitle": "Channel"},
+            }
+            for yt_id in ids
+            if yt_id and not yt_id.startswith("missing")
+        ]
+        body = json.dumps({"items": items}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start():
+    """Start the stub server in a background thread and return it."""
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []  # Paths of every request received.
+    server.url = "http://127.0.0.1:%d/youtube/v3/videos" % server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server